@@ -0,0 +1,37 @@
+# audio_cache.py
+
+import hashlib
+import json
+import unicodedata
+from app.config import S3_BUCKET_NAME, ELEVEN_OUTPUT_FORMAT
+from app.chunker import normalize, segment_id
+from app.s3 import put_bytes, get_bytes
+from app import metrics
+
+# Synthesized segment audio is cached in S3 under the voice, a hash of
+# everything else that shapes the audio (model, voice settings, output
+# format) and a hash of the normalized text. Re-synthesizing a book after a
+# small edit finds every untouched segment here and only pays for the rest.
+
+def settings_hash(model_id, voice_settings=None, output_format=ELEVEN_OUTPUT_FORMAT):
+    settings = {'model_id': model_id, 'voice_settings': voice_settings or {}, 'output_format': output_format}
+    return hashlib.sha256(json.dumps(settings, sort_keys=True).encode()).hexdigest()[:16]
+
+def text_hash(text):
+    return segment_id(unicodedata.normalize("NFC", normalize(text)))
+
+def cache_key(voice_id, model_id, voice_settings, text):
+    return f"audio-cache/{voice_id}/{settings_hash(model_id, voice_settings)}/{text_hash(text)}.mp3"
+
+def get_cached_audio(key, characters):
+    audio = get_bytes(S3_BUCKET_NAME, key)
+    if audio is None:
+        metrics.increment('audio_cache_misses')
+        metrics.increment('audio_cache_miss_characters', characters)
+    else:
+        metrics.increment('audio_cache_hits')
+        metrics.increment('audio_cache_hit_characters', characters)
+    return audio
+
+def put_cached_audio(key, audio):
+    put_bytes(S3_BUCKET_NAME, key, audio, 'audio/mpeg')
@@ -0,0 +1,192 @@
+# chunker.py
+
+import hashlib
+import re
+import zlib
+from app.config import SEGMENT_TARGET_CHARS, SEGMENT_MAX_CHARS
+
+# Splits chapter text into segments for TTS requests. Segments end at
+# paragraph or sentence ends and never grow past the maximum, which stays
+# under the provider's per-request limit. Once a segment is past half the
+# target size it ends at the first unit whose checksum picks it as a
+# boundary, and it is cut at twice the target if none has come up. Those
+# boundaries depend only on the text of the unit, so after an edit the
+# segmentation falls back into step within a segment or two and the rest
+# of the chapter keeps its segments, and so their ids.
+
+# About one unit end in BOUNDARY_MODULUS is a preferred boundary
+BOUNDARY_MODULUS = 4
+
+# A line shorter than this that ends without punctuation is a heading or a
+# paragraph of its own; longer lines without it are wrapped (PDF text)
+WRAP_CHARS = 50
+TERMINAL = set(".!?…:;\"'”’)]")
+
+ABBREVIATIONS = {
+    "mr", "mrs", "ms", "dr", "prof", "st", "sr", "jr", "vs", "mt", "ft", "lt", "col", "gen", "capt",
+    "sgt", "rev", "hon", "gov", "sen", "rep", "no", "nos", "fig", "vol", "ch", "pp", "ca", "approx",
+    "dept", "est", "inc", "ltd", "co", "corp", "jan", "feb", "mar", "apr", "jun", "jul", "aug",
+    "sep", "sept", "oct", "nov", "dec", "e.g", "i.e", "cf", "al", "viz",
+}
+
+LINE_BREAK_RE = re.compile(r"\n\s*")
+# Sentence-ending punctuation, any closing quotes or brackets, then the
+# start of the next sentence. A lowercase word after the quote (as in
+# "Stop!" he said.) keeps dialogue and its tag together.
+SENTENCE_END_RE = re.compile(r"[.!?…]+[\"'”’)\]]*\s+(?=[\"'“‘(\[]*[^\W_a-z])")
+WORD_BEFORE_RE = re.compile(r"[\w.]+$")
+
+
+def segment_id(text):
+    return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+
+
+def normalize(text):
+    # Most paragraphs have nothing to collapse, and checking is much cheaper
+    # than splitting them into words
+    if "\n" in text or "  " in text or "\t" in text or "\r" in text or "\xa0" in text:
+        return " ".join(text.split())
+    return text.strip()
+
+
+def is_abbreviation(text, start, end):
+    # The word before a single "." at `end`, e.g. "Dr." or the "J." of an
+    # initial
+    match = WORD_BEFORE_RE.search(text, max(start, end - 12), end)
+    if not match:
+        return False
+    word = match.group().lower().strip(".")
+    return word in ABBREVIATIONS or (len(word) == 1 and word.isalpha())
+
+
+def paragraph_breaks(text, start=0, paragraph_start=0):
+    # (end of paragraph, start of the next) for each line break from `start`
+    # on that ends a paragraph. Breaks that run into the end of the text are
+    # left out, as more text may still arrive.
+    for match in LINE_BREAK_RE.finditer(text, start):
+        break_start, break_end = match.span()
+        if break_end == len(text):
+            break
+        line_start = max(text.rfind("\n", 0, break_start) + 1, paragraph_start)
+        if (break_start - line_start < WRAP_CHARS or match.group().count("\n") > 1
+                or text[line_start:break_start].rstrip()[-1:] in TERMINAL):
+            yield break_start, break_end
+            paragraph_start = break_end
+
+
+def split_long(text, start, end, max_chars):
+    # Spans of at most max_chars from a sentence too long for one request,
+    # cut after clause punctuation or, failing that, at whitespace
+    while end - start > max_chars:
+        window = text[start:start + max_chars]
+        cut = max(window.rfind(mark + " ") for mark in ",;:—–") + 1
+        if cut <= 0:
+            cut = window.rfind(" ")
+        if cut <= 0:
+            cut = max_chars
+        yield start, start + cut
+        start += cut
+        while start < end and text[start].isspace():
+            start += 1
+    if end > start:
+        yield start, end
+
+
+def sentence_spans(text, start, end, max_chars):
+    sentence_start = start
+    for match in SENTENCE_END_RE.finditer(text, start, end):
+        stop = match.start()
+        if text[stop] == "." and text[stop + 1:stop + 2] != "." and is_abbreviation(text, sentence_start, stop):
+            continue
+        sentence_end = stop + len(match.group().rstrip())
+        yield from split_long(text, sentence_start, sentence_end, max_chars)
+        sentence_start = match.end()
+    if end > sentence_start:
+        yield from split_long(text, sentence_start, end, max_chars)
+
+
+def paragraph_units(text, start, end, max_chars, split):
+    # A paragraph that fits in one request is a single unit; a longer one is
+    # split into its sentences
+    if split or end - start > max_chars:
+        return sentence_spans(text, start, end, max_chars)
+    return [(start, end)]
+
+
+def iter_units(pieces, max_chars):
+    # (start, end, text) for each paragraph or sentence, with start and end
+    # as offsets into the concatenated pieces
+    buffer = ""
+    base = 0
+    split = False
+    for piece in pieces:
+        # Breaks before the new piece have been handled already, apart from
+        # one that ran into the end of the buffer
+        tail = buffer[-256:]
+        resume = len(buffer) - len(tail) + len(tail.rstrip())
+        buffer += piece
+        position = 0
+        for paragraph_end, next_start in paragraph_breaks(buffer, resume):
+            for start, end in paragraph_units(buffer, position, paragraph_end, max_chars, split):
+                yield base + start, base + end, buffer[start:end]
+            position = next_start
+            split = False
+
+        # A paragraph that goes on without a break is split into sentences
+        # as it arrives, keeping back the last one as it may be unfinished
+        if len(buffer) - position > 4 * max_chars:
+            units = list(sentence_spans(buffer, position, len(buffer), max_chars))
+            for start, end in units[:-1]:
+                yield base + start, base + end, buffer[start:end]
+            if units:
+                position = units[-1][0]
+                split = True
+
+        buffer = buffer[position:]
+        base += position
+
+    end = len(buffer.rstrip())
+    start = len(buffer) - len(buffer.lstrip())
+    if end > start:
+        for start, end in paragraph_units(buffer, start, end, max_chars, split):
+            yield base + start, base + end, buffer[start:end]
+
+
+def iter_segments(pieces, target_chars=SEGMENT_TARGET_CHARS, max_chars=SEGMENT_MAX_CHARS):
+    # Pack units into segments from an iterable of text pieces (a whole
+    # chapter, or chunks of one as they are read). Segment text has its
+    # whitespace collapsed, as that is what gets sent and hashed.
+    index = 0
+    parts = []
+    size = 0
+    start = end = 0
+    for unit_start, unit_end, raw in iter_units(pieces, max_chars):
+        text = normalize(raw)
+        if not text:
+            continue
+        if parts and size + 1 + len(text) > max_chars:
+            yield make_segment(index, start, end, parts)
+            index += 1
+            parts = []
+        if not parts:
+            start = unit_start
+            size = -1
+        parts.append(text)
+        size += 1 + len(text)
+        end = unit_end
+        if size >= 2 * target_chars or (size >= target_chars // 2
+                                        and zlib.crc32(text.encode()) % BOUNDARY_MODULUS == 0):
+            yield make_segment(index, start, end, parts)
+            index += 1
+            parts = []
+    if parts:
+        yield make_segment(index, start, end, parts)
+
+
+def make_segment(index, start, end, parts):
+    text = " ".join(parts)
+    return {'id': segment_id(text), 'index': index, 'start': start, 'end': end, 'text': text}
+
+
+def split_segments(text, target_chars=SEGMENT_TARGET_CHARS, max_chars=SEGMENT_MAX_CHARS):
+    return list(iter_segments([text], target_chars, max_chars))
@@ -12,3 +12,59 @@ SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 SECRET_KEY = os.getenv("SECRET_KEY")
 S3_BUCKET_NAME = os.getenv("S3_BUCKET_NAME")
 ELEVEN_API_KEY = os.getenv("ELEVEN_API_KEY")
+
+MAX_UPLOAD_SIZE = int(os.getenv("MAX_UPLOAD_SIZE", 10 * 1024 * 1024))
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", 1024 * 1024))
+S3_PART_SIZE = int(os.getenv("S3_PART_SIZE", 8 * 1024 * 1024))
+MAX_RESUMABLE_UPLOAD_SIZE = int(os.getenv("MAX_RESUMABLE_UPLOAD_SIZE", 512 * 1024 * 1024))
+UPLOAD_PART_MAX_SIZE = int(os.getenv("UPLOAD_PART_MAX_SIZE", 16 * 1024 * 1024))
+# S3 rejects any part but the last below 5 MiB
+UPLOAD_PART_MIN_SIZE = 5 * 1024 * 1024
+PRESIGNED_URL_EXPIRY = int(os.getenv("PRESIGNED_URL_EXPIRY", 3600))
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", 4))
+INGEST_LEASE_SECONDS = float(os.getenv("INGEST_LEASE_SECONDS", 900))
+INGEST_MAX_ATTEMPTS = int(os.getenv("INGEST_MAX_ATTEMPTS", 3))
+EXTRACT_WORKERS = int(os.getenv("EXTRACT_WORKERS", os.cpu_count() or 1))
+EXTRACT_TIMEOUT = float(os.getenv("EXTRACT_TIMEOUT", 120))
+EXTRACT_MEMORY_LIMIT = int(os.getenv("EXTRACT_MEMORY_LIMIT", 1024 * 1024 * 1024))
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", 50))
+EXTRACT_CACHE_DIR = os.getenv("EXTRACT_CACHE_DIR", "/tmp/scriptorium-extract-cache")
+EXTRACT_CACHE_MAX_BYTES = int(os.getenv("EXTRACT_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+TEXT_CHUNK_CHARS = int(os.getenv("TEXT_CHUNK_CHARS", 64 * 1024))
+TEXT_WINDOW_MAX_CHARS = int(os.getenv("TEXT_WINDOW_MAX_CHARS", 256 * 1024))
+TEXT_CHUNK_CACHE_SIZE = int(os.getenv("TEXT_CHUNK_CACHE_SIZE", 128))
+SEGMENT_TARGET_CHARS = int(os.getenv("SEGMENT_TARGET_CHARS", 1000))
+SEGMENT_MAX_CHARS = int(os.getenv("SEGMENT_MAX_CHARS", 2500))
+ELEVEN_MODEL_ID = os.getenv("ELEVEN_MODEL_ID", "eleven_monolingual_v1")
+ELEVEN_OUTPUT_FORMAT = os.getenv("ELEVEN_OUTPUT_FORMAT", "mp3_44100_128")
+ELEVEN_TIMEOUT = float(os.getenv("ELEVEN_TIMEOUT", 120))
+SYNTHESIS_CONCURRENCY = int(os.getenv("SYNTHESIS_CONCURRENCY", 4))
+SYNTHESIS_CHAPTERS_IN_FLIGHT = int(os.getenv("SYNTHESIS_CHAPTERS_IN_FLIGHT", 2))
+# Fair-share weights for particular users, as "user_id:weight,user_id:weight"
+SYNTHESIS_USER_WEIGHTS = {user_id: float(weight) for user_id, weight in
+                          (item.split(':') for item in os.getenv("SYNTHESIS_USER_WEIGHTS", "").split(',') if item)}
+ELEVEN_REQUESTS_PER_SECOND = float(os.getenv("ELEVEN_REQUESTS_PER_SECOND", 2))
+ELEVEN_REQUEST_BURST = int(os.getenv("ELEVEN_REQUEST_BURST", 4))
+ELEVEN_MIN_REQUESTS_PER_SECOND = float(os.getenv("ELEVEN_MIN_REQUESTS_PER_SECOND", 0.1))
+ELEVEN_MONTHLY_CHARACTERS = int(os.getenv("ELEVEN_MONTHLY_CHARACTERS", 500000))
+ELEVEN_QUOTA_SYNC_INTERVAL = float(os.getenv("ELEVEN_QUOTA_SYNC_INTERVAL", 600))
+SYNTHESIS_STREAM_LOOKAHEAD = int(os.getenv("SYNTHESIS_STREAM_LOOKAHEAD", 3))
+SYNTHESIS_TIME_BUDGET = float(os.getenv("SYNTHESIS_TIME_BUDGET", 840))
+SYNTHESIS_DEADLINE_MARGIN = float(os.getenv("SYNTHESIS_DEADLINE_MARGIN", 90))
+SYNTHESIS_LEASE_SECONDS = float(os.getenv("SYNTHESIS_LEASE_SECONDS", 60))
+SYNTHESIS_MAX_ATTEMPTS = int(os.getenv("SYNTHESIS_MAX_ATTEMPTS", 3))
+SYNTHESIS_JOB_MAX_ATTEMPTS = int(os.getenv("SYNTHESIS_JOB_MAX_ATTEMPTS", 5))
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", 4))
+PIPELINE_PROCESS_WORKERS = int(os.getenv("PIPELINE_PROCESS_WORKERS", 2))
+PIPELINE_UPLOAD_WORKERS = int(os.getenv("PIPELINE_UPLOAD_WORKERS", 4))
+ELEVEN_CONNECT_TIMEOUT = float(os.getenv("ELEVEN_CONNECT_TIMEOUT", 10))
+ELEVEN_MAX_CONNECTIONS = int(os.getenv("ELEVEN_MAX_CONNECTIONS", 10))
+ELEVEN_MAX_RETRIES = int(os.getenv("ELEVEN_MAX_RETRIES", 3))
+ELEVEN_RETRY_BACKOFF = float(os.getenv("ELEVEN_RETRY_BACKOFF", 0.5))
+ESTIMATE_SECONDS_PER_CHARACTER = float(os.getenv("ESTIMATE_SECONDS_PER_CHARACTER", 0.065))
+ESTIMATE_REQUEST_SECONDS = float(os.getenv("ESTIMATE_REQUEST_SECONDS", 4))
+ESTIMATE_STATS_TTL = float(os.getenv("ESTIMATE_STATS_TTL", 300))
+ESTIMATE_RATE_SAMPLES = int(os.getenv("ESTIMATE_RATE_SAMPLES", 200))
+VOICE_SAMPLES_MAX_BYTES = int(os.getenv("VOICE_SAMPLES_MAX_BYTES", 100 * 1024 * 1024))
+VOICE_SAMPLE_SPOOL_SIZE = int(os.getenv("VOICE_SAMPLE_SPOOL_SIZE", 4 * 1024 * 1024))
+VOICE_SAMPLE_DOWNLOADS = int(os.getenv("VOICE_SAMPLE_DOWNLOADS", 8))
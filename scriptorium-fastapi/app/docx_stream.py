@@ -0,0 +1,94 @@
+# docx_stream.py
+
+import zipfile
+from lxml import etree
+
+# Streams paragraphs out of word/document.xml with iterparse instead of
+# building python-docx's object tree. Each top-level element of the body is
+# cleared once it has been read, so memory stays flat however long the
+# manuscript is. Like python-docx's Document.paragraphs, only paragraphs
+# directly in the body are returned (table contents are skipped).
+
+W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+W_BODY = W + "body"
+W_P = W + "p"
+W_T = W + "t"
+W_TAB = W + "tab"
+W_BR = W + "br"
+W_CR = W + "cr"
+W_PPR = W + "pPr"
+W_PSTYLE = W + "pStyle"
+W_STYLE = W + "style"
+W_NAME = W + "name"
+W_VAL = W + "val"
+W_STYLE_ID = W + "styleId"
+
+def read_style_names(docx):
+    # Map style ids (e.g. "Heading1") to their names (e.g. "heading 1")
+    try:
+        with docx.open("word/styles.xml") as f:
+            styles = etree.parse(f).getroot()
+    except KeyError:
+        return {}
+
+    names = {}
+    for style in styles.iter(W_STYLE):
+        name = style.find(W_NAME)
+        if name is not None:
+            names[style.get(W_STYLE_ID)] = name.get(W_VAL)
+    return names
+
+def paragraph_text(p):
+    parts = []
+    for node in p.iter(W_T, W_TAB, W_BR, W_CR):
+        if node.tag == W_T:
+            parts.append(node.text or "")
+        elif node.tag == W_TAB:
+            parts.append("\t")
+        else:
+            parts.append("\n")
+    return "".join(parts)
+
+def paragraph_style(p, style_names):
+    style = p.find(f"{W_PPR}/{W_PSTYLE}")
+    if style is None:
+        return None
+    style_id = style.get(W_VAL)
+    return style_names.get(style_id, style_id)
+
+def iter_docx_paragraphs(fileobj):
+    # Yield (style name, text) for each paragraph in the document body
+    with zipfile.ZipFile(fileobj) as docx:
+        style_names = read_style_names(docx)
+        with docx.open("word/document.xml") as f:
+            for _, elem in etree.iterparse(f, events=("end",)):
+                parent = elem.getparent()
+                if parent is None or parent.tag != W_BODY:
+                    continue
+                if elem.tag == W_P:
+                    yield paragraph_style(elem, style_names), paragraph_text(elem)
+                # Drop the element and everything before it in the body
+                elem.clear()
+                while elem.getprevious() is not None:
+                    del parent[0]
+
+def heading_level(style):
+    # 1 for "heading 1" / "Heading 1", etc.; None for anything else
+    if style and style.lower().startswith("heading "):
+        level = style[len("heading "):].strip()
+        if level.isdigit():
+            return int(level)
+    return None
+
+def find_docx_headings(fileobj):
+    # (paragraph index, title) of each paragraph in the highest heading
+    # level the document uses
+    headings = []
+    for index, (style, text) in enumerate(iter_docx_paragraphs(fileobj)):
+        level = heading_level(style)
+        if level is not None and text.strip():
+            headings.append((index, text.strip(), level))
+    if not headings:
+        return []
+    top = min(level for _, _, level in headings)
+    return [(index, title) for index, title, level in headings if level == top]
@@ -0,0 +1,92 @@
+# elevenlabs.py
+
+import httpx
+from app.config import ELEVEN_API_KEY, ELEVEN_MODEL_ID, ELEVEN_OUTPUT_FORMAT, ELEVEN_TIMEOUT, \
+    ELEVEN_CONNECT_TIMEOUT, ELEVEN_MAX_CONNECTIONS
+
+ELEVEN_API_URL = "https://api.elevenlabs.io/v1"
+
+# All ElevenLabs requests share one client for the life of the app, so
+# connections (and their TLS sessions) are kept alive and reused, and the
+# pool caps how many are open at once. It is opened on startup, or on
+# first use where no startup event runs.
+client = None
+
+
+class ElevenLabsError(Exception):
+    def __init__(self, status_code, detail, retry_after=None):
+        super().__init__(f"ElevenLabs returned {status_code}: {detail}")
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+def api_headers(accept="application/json"):
+    return {"accept": accept, "xi-api-key": ELEVEN_API_KEY}
+
+
+def new_client():
+    return httpx.AsyncClient(
+        base_url=ELEVEN_API_URL,
+        timeout=httpx.Timeout(ELEVEN_TIMEOUT, connect=ELEVEN_CONNECT_TIMEOUT),
+        limits=httpx.Limits(max_connections=ELEVEN_MAX_CONNECTIONS,
+                            max_keepalive_connections=ELEVEN_MAX_CONNECTIONS),
+    )
+
+
+def get_client():
+    global client
+    if client is None:
+        client = new_client()
+    return client
+
+
+async def close_client():
+    global client
+    if client is not None:
+        await client.aclose()
+        client = None
+
+
+def bitrate(output_format=ELEVEN_OUTPUT_FORMAT):
+    # Bits per second of an output format such as "mp3_44100_128"
+    return int(output_format.rsplit("_", 1)[1]) * 1000
+
+
+def check_response(response):
+    if response.status_code >= 400:
+        retry_after = response.headers.get("retry-after")
+        raise ElevenLabsError(response.status_code, response.text,
+                              float(retry_after) if retry_after and retry_after.isdigit() else None)
+    return response
+
+
+async def text_to_speech(client, voice_id, text, model_id=ELEVEN_MODEL_ID, voice_settings=None,
+                         output_format=ELEVEN_OUTPUT_FORMAT):
+    # MP3 bytes for one segment of text
+    body = {"text": text, "model_id": model_id}
+    if voice_settings:
+        body["voice_settings"] = voice_settings
+    response = await client.post(f"/text-to-speech/{voice_id}", json=body,
+                                 params={"output_format": output_format},
+                                 headers=api_headers("audio/mpeg"))
+    return check_response(response).content
+
+
+async def get_subscription(client):
+    # Includes character_count and character_limit for the current period
+    response = await client.get("/user/subscription", headers=api_headers())
+    return check_response(response).json()
+
+
+async def add_voice(client, name, samples):
+    # Clone a voice from (filename, bytes or file object, content type)
+    # samples. File objects are rewound first, so a retried request sends
+    # them whole.
+    for _, sample, _ in samples:
+        if hasattr(sample, 'seek'):
+            sample.seek(0)
+    response = await client.post("/voices/add", data={"name": name},
+                                 files=[("files", sample) for sample in samples],
+                                 headers=api_headers())
+    return check_response(response).json()
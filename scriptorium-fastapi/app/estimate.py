@@ -0,0 +1,131 @@
+# estimate.py
+
+import math
+import time
+from fastapi import HTTPException
+from app.db import supabase
+from app.config import ELEVEN_MODEL_ID, SEGMENT_TARGET_CHARS, SYNTHESIS_CONCURRENCY, ESTIMATE_SECONDS_PER_CHARACTER, \
+    ESTIMATE_REQUEST_SECONDS, ESTIMATE_STATS_TTL, ESTIMATE_RATE_SAMPLES
+from app.audio_cache import settings_hash
+from app.fairqueue import PRIORITIES
+from app.ratelimit import scheduler
+from app.synthesis import slots
+from app import metrics
+
+# What synthesizing a project would cost and how long it would take,
+# worked out before anything is synthesized and without reading any text:
+#
+# - characters come from project_files.num_characters, kept up to date on
+#   ingest and on every text edit;
+# - a chapter whose text hasn't changed since it was last synthesized with
+#   the same voice, model and voice settings (the audio cache key depends
+#   on all three) comes back from the audio cache for free; one that has
+#   been edited since is assumed to bill only around its edits (see
+#   manifest.py);
+# - audio length uses the voice's speaking rate, learned from the
+#   characters and seconds of its most recent synthesized chapters, with
+#   the same settings where there are any. Each chapter's synthesized_audio
+#   row is its own sample, so concurrent jobs never update shared totals;
+# - wall-clock time comes from the requests needed, how many run at once,
+#   the request rate, how long requests have been taking and how many are
+#   already queued ahead.
+
+# Voice speaking rates, briefly cached in process
+voice_rates = {}
+
+
+def speaking_rate(voice_id, settings):
+    # Seconds of audio per character
+    cached = voice_rates.get((voice_id, settings))
+    if cached is not None and cached[0] > time.monotonic():
+        return cached[1]
+
+    response = supabase.table('synthesized_audio') \
+                .select('settings', 'characters', 'audio_length') \
+                .match({'voice_used': voice_id, 'successful': True}) \
+                .order('id', desc=True) \
+                .limit(ESTIMATE_RATE_SAMPLES) \
+                .execute()
+    samples = [row for row in response.get('data') or [] if row['characters'] and row['audio_length']]
+    samples = [row for row in samples if row['settings'] == settings] or samples
+    characters = sum(row['characters'] for row in samples)
+    rate = sum(row['audio_length'] for row in samples) / characters if characters else \
+        ESTIMATE_SECONDS_PER_CHARACTER
+    voice_rates[(voice_id, settings)] = (time.monotonic() + ESTIMATE_STATS_TTL, rate)
+    return rate
+
+
+def billed_characters(num_characters, text_sha256, previous):
+    # Characters a chapter would be billed for, given its last successful
+    # synthesis with the same voice and settings
+    if previous is None:
+        return num_characters
+    if previous.get('text_sha256') == text_sha256:
+        return 0
+    # An edit re-bills the segments it touches: the size change plus about
+    # a segment on either side
+    changed = abs(num_characters - (previous.get('characters') or 0)) + 2 * SEGMENT_TARGET_CHARS
+    return min(num_characters, changed)
+
+
+def request_seconds():
+    summary = metrics.snapshot()['summaries'].get('eleven_tts_seconds')
+    return summary['mean'] if summary and summary['count'] else ESTIMATE_REQUEST_SECONDS
+
+
+def estimate_project(project_id, user_id, voice_id, priority='export', model_id=None, voice_settings=None):
+    settings = settings_hash(model_id or ELEVEN_MODEL_ID, voice_settings)
+    project = supabase.table('projects') \
+                .select('id') \
+                .match({'id': project_id, 'user_id': user_id}) \
+                .execute()
+
+    if not project or not project.get('data'):
+        raise HTTPException(status_code=404, detail="Project not found.")
+
+    project_files = supabase.table('project_files') \
+                        .select('file_id', 'num_characters') \
+                        .match({'project_id': project_id}) \
+                        .execute()
+    project_files = project_files.get('data') or []
+    if not project_files:
+        raise HTTPException(status_code=400, detail="Project has no text to synthesize.")
+
+    file_ids = [pf['file_id'] for pf in project_files]
+    files = supabase.table('files') \
+                .select('id', 'text_sha256') \
+                .in_('id', file_ids) \
+                .execute()
+    text_sha256 = {f['id']: f['text_sha256'] for f in files.get('data') or []}
+
+    history = supabase.table('synthesized_audio') \
+                .select('source_file', 'text_sha256', 'characters') \
+                .match({'project_id': project_id, 'voice_used': voice_id, 'settings': settings,
+                        'successful': True}) \
+                .order('id') \
+                .execute()
+    # Later rows win
+    previous = {row['source_file']: row for row in history.get('data') or []}
+
+    characters = sum(pf['num_characters'] or 0 for pf in project_files)
+    billed = sum(billed_characters(pf['num_characters'] or 0, text_sha256.get(pf['file_id']),
+                                   previous.get(pf['file_id']))
+                 for pf in project_files)
+
+    # Requests run SYNTHESIS_CONCURRENCY at a time, and no faster than the
+    # scheduler's current request rate; those already queued at the same
+    # or a higher priority go first
+    requests = math.ceil(billed / SEGMENT_TARGET_CHARS)
+    queued = sum(count for name, count in slots.queued.items() if PRIORITIES[name] <= PRIORITIES[priority])
+    throughput = min(SYNTHESIS_CONCURRENCY / request_seconds(), scheduler.requests.rate)
+    wall_clock = (requests + queued) / throughput if requests else 0.0
+
+    return {
+        'characters': characters,
+        'billed_characters': billed,
+        'cached_characters': characters - billed,
+        'audio_seconds': round(characters * speaking_rate(voice_id, settings)),
+        'wall_clock_seconds': round(wall_clock),
+        'queued_requests': queued,
+        'within_quota': billed <= scheduler.characters.tokens,
+    }
@@ -0,0 +1,108 @@
+# extract_cache.py
+
+import gzip
+import json
+import os
+from tempfile import NamedTemporaryFile
+from app.config import S3_BUCKET_NAME, EXTRACT_CACHE_DIR, EXTRACT_CACHE_MAX_BYTES
+from app.extraction import extract_document, extract_headings, EXTRACTOR_VERSION
+from app.s3 import put_bytes, get_bytes
+from app.segment import HeadingScanner
+from app.text_store import store_text
+
+# A document's text is streamed from the extraction child straight into the
+# text store, passing the heading scanner on the way, so no step holds the
+# whole text. What comes out is cached by document hash and extractor
+# version, first on local disk (LRU by access time, bounded by
+# EXTRACT_CACHE_MAX_BYTES), then in S3. Entries are gzipped JSON holding the
+# stored text's pointers, its block offsets, the document's chapter headings
+# and the heading-like lines found in the text.
+# Bumping EXTRACTOR_VERSION changes every key, so stale entries are simply
+# never read again; the local LRU ages them out.
+
+def cache_name(sha256):
+    return f"{sha256}-v{EXTRACTOR_VERSION}.json.gz"
+
+def local_path(sha256):
+    return os.path.join(EXTRACT_CACHE_DIR, cache_name(sha256))
+
+def s3_key(sha256):
+    return f"extract-cache/v{EXTRACTOR_VERSION}/{sha256}.json.gz"
+
+def encode(entry):
+    return gzip.compress(json.dumps(entry).encode())
+
+def decode(data):
+    entry = json.loads(gzip.decompress(data))
+    entry['headings'] = [tuple(heading) for heading in entry['headings']]
+    entry['boundaries'] = [tuple(boundary) for boundary in entry['boundaries']]
+    return entry
+
+def read_local(sha256):
+    path = local_path(sha256)
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+        os.utime(path)
+        return data
+    except FileNotFoundError:
+        return None
+
+def write_local(sha256, data):
+    os.makedirs(EXTRACT_CACHE_DIR, exist_ok=True)
+    with NamedTemporaryFile(dir=EXTRACT_CACHE_DIR, delete=False) as f:
+        f.write(data)
+    os.replace(f.name, local_path(sha256))
+    evict_local()
+
+def evict_local():
+    entries = []
+    for entry in os.scandir(EXTRACT_CACHE_DIR):
+        try:
+            stat = entry.stat()
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= EXTRACT_CACHE_MAX_BYTES:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+def get_cached(sha256):
+    data = read_local(sha256)
+    if data is None:
+        data = get_bytes(S3_BUCKET_NAME, s3_key(sha256))
+        if data is None:
+            return None
+        write_local(sha256, data)
+    return decode(data)
+
+def put_cached(sha256, entry):
+    data = encode(entry)
+    write_local(sha256, data)
+    put_bytes(S3_BUCKET_NAME, s3_key(sha256), data, 'application/gzip')
+
+def extract_and_store(path, content_type):
+    offsets = []
+    scanner = HeadingScanner()
+    pointers = store_text(scanner.scan(extract_document(path, content_type, offsets)))
+    return {
+        **pointers,
+        'offsets': offsets,
+        'headings': extract_headings(path, content_type),
+        'boundaries': scanner.boundaries(),
+    }
+
+def extract_document_cached(path, content_type, sha256):
+    cached = get_cached(sha256)
+    if cached is not None:
+        return cached
+    entry = extract_and_store(path, content_type)
+    put_cached(sha256, entry)
+    return entry
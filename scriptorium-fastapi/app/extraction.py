@@ -0,0 +1,129 @@
+# extraction.py
+
+import multiprocessing
+import resource
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from app.config import EXTRACT_WORKERS, EXTRACT_TIMEOUT, EXTRACT_MEMORY_LIMIT, PDF_PAGES_PER_TASK
+from app.utils import iter_text_file_blocks, count_pdf_pages, extract_pdf_pages, join_blocks, find_headings, \
+    PDF_TYPE
+
+# Bump when a change to extraction would produce different text, or changes
+# what a cache entry holds, so cached results from the old code are not used
+EXTRACTOR_VERSION = 5
+
+# Each extraction runs in its own short-lived child process, forked from a
+# server that already has the parsers imported. A parse that crashes, runs
+# past its timeout or hits its memory limit takes down only that child. A
+# plain Pipe is used instead of a ProcessPoolExecutor because the pool's
+# queues need /dev/shm, which Lambda does not provide.
+context = multiprocessing.get_context("forkserver")
+context.set_forkserver_preload(["app.utils"])
+slots = threading.BoundedSemaphore(EXTRACT_WORKERS)
+
+# Threads that wait on the children of a page-parallel PDF extraction
+fanout = ThreadPoolExecutor(max_workers=EXTRACT_WORKERS, thread_name_prefix="extract")
+
+
+class ExtractionError(Exception):
+    pass
+
+
+def address_space():
+    # Virtual size the child starts out with; imported libraries reserve far
+    # more address space than they touch, so the limit is set on top of it
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmSize:'):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def run_child(conn, func, args, memory_limit, stream):
+    # Messages are ('block', value) for each item a streaming func yields,
+    # then ('done', result) or ('error', message). The pipe blocks the child
+    # when the parent falls behind, so blocks never pile up in memory.
+    try:
+        if memory_limit:
+            limit = address_space() + memory_limit
+            resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+        if stream:
+            for block in func(*args):
+                conn.send(('block', block))
+            conn.send(('done', None))
+        else:
+            conn.send(('done', func(*args)))
+    except BaseException as e:
+        conn.send(('error', f"{type(e).__name__}: {e}"))
+    conn.close()
+
+
+def iter_isolated(func, *args, stream=True, timeout=EXTRACT_TIMEOUT, memory_limit=EXTRACT_MEMORY_LIMIT):
+    with slots:
+        receiver, sender = context.Pipe(duplex=False)
+        process = context.Process(target=run_child, args=(sender, func, args, memory_limit, stream),
+                                  daemon=True)
+        process.start()
+        sender.close()
+        deadline = time.monotonic() + timeout
+        try:
+            while True:
+                if not receiver.poll(max(0, deadline - time.monotonic())):
+                    raise ExtractionError(f"Extraction timed out after {timeout:g}s")
+                kind, value = receiver.recv()
+                if kind == 'error':
+                    raise ExtractionError(value)
+                if kind == 'block' or not stream:
+                    yield value
+                if kind == 'done':
+                    return
+        except EOFError:
+            process.join()
+            raise ExtractionError(f"Extraction process exited with code {process.exitcode}")
+        finally:
+            if process.is_alive():
+                process.kill()
+            process.join()
+            receiver.close()
+
+
+def run_isolated(func, *args, **kwargs):
+    result, = iter_isolated(func, *args, stream=False, **kwargs)
+    return result
+
+
+def extract_pdf_range(path, page_range):
+    return run_isolated(extract_pdf_pages, path, *page_range)
+
+
+def iter_document_blocks(path, content_type):
+    # Yield the document a page (PDF) or paragraph (DOCX) at a time. Long
+    # PDFs are split into page ranges extracted in parallel, one child per
+    # range; only a window of EXTRACT_WORKERS ranges is in flight, so memory
+    # does not grow with the length of the book.
+    if content_type != PDF_TYPE:
+        yield from iter_isolated(iter_text_file_blocks, path, content_type)
+        return
+
+    num_pages = run_isolated(count_pdf_pages, path)
+    pending = deque()
+    for start in range(0, num_pages, PDF_PAGES_PER_TASK):
+        page_range = (start, min(start + PDF_PAGES_PER_TASK, num_pages))
+        pending.append(fanout.submit(extract_pdf_range, path, page_range))
+        if len(pending) >= EXTRACT_WORKERS:
+            yield from pending.popleft().result()
+    while pending:
+        yield from pending.popleft().result()
+
+
+def extract_document(path, content_type, offsets):
+    # The document's text as a stream of pieces, appending the offset at
+    # which each page / paragraph starts to `offsets` as it goes
+    return join_blocks(iter_document_blocks(path, content_type), offsets)
+
+
+def extract_headings(path, content_type):
+    # The chapter headings marked up in the document, as (block index, title)
+    return run_isolated(find_headings, path, content_type)
@@ -0,0 +1,95 @@
+# fairqueue.py
+
+import asyncio
+import heapq
+import itertools
+import time
+from app import metrics
+
+# Hands out the synthesis request slots. Waiting requests are served by
+# class first (an interactive preview before a full export before batch
+# work) and, within a class, by weighted fair queuing across users: each
+# request gets a virtual finish tag of the user's previous tag (or the
+# class's current virtual time, if later) plus its cost over the user's
+# weight, and the lowest tag goes next. A user with one chapter is not
+# stuck behind another user's thirty books, however many segments those
+# queued first.
+#
+# A user's weight comes from the `weights` hook (user id -> weight), so
+# plans or accounts can be given a larger share; an explicit weight passed
+# to acquire() overrides it. A finish tag is forgotten once the class's
+# virtual time has caught up with it, since from then on it no longer
+# affects the user's next tag.
+
+PRIORITIES = {'preview': 0, 'export': 1, 'batch': 2}
+
+
+class FairQueue:
+    def __init__(self, slots, weights=None):
+        self.free = slots
+        self.weights = weights or (lambda user_id: 1)
+        self.waiting = []
+        self.counter = itertools.count()
+        self.virtual_time = {priority: 0.0 for priority in PRIORITIES}
+        self.finish_tags = {}
+        self.queued = {priority: 0 for priority in PRIORITIES}
+
+    def count(self, priority, change):
+        self.queued[priority] += change
+        metrics.set_gauge(f'synthesis_queue_depth.{priority}', self.queued[priority])
+
+    def dispatch(self):
+        while self.free > 0 and self.waiting:
+            _, tag, _, priority, user_id, granted = heapq.heappop(self.waiting)
+            if not granted.done():
+                self.free -= 1
+                self.virtual_time[priority] = tag
+                granted.set_result(None)
+                self.count(priority, -1)
+            # Otherwise its waiter was cancelled
+            key = (priority, user_id)
+            if self.finish_tags.get(key, tag) <= self.virtual_time[priority]:
+                self.finish_tags.pop(key, None)
+        if not self.waiting:
+            # Nothing left queued to be fair to; only cancelled requests'
+            # tags can still be ahead of virtual time
+            self.finish_tags.clear()
+
+    async def acquire(self, user_id, priority='export', cost=1, weight=None):
+        started = time.monotonic()
+        weight = weight or self.weights(user_id)
+        tag = max(self.virtual_time[priority], self.finish_tags.get((priority, user_id), 0)) + cost / weight
+        self.finish_tags[(priority, user_id)] = tag
+        granted = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiting, (PRIORITIES[priority], tag, next(self.counter), priority, user_id, granted))
+        self.count(priority, 1)
+        self.dispatch()
+        try:
+            await granted
+        except asyncio.CancelledError:
+            if granted.done() and not granted.cancelled():
+                # Cancelled just after being handed a slot: pass it on
+                self.release()
+            else:
+                self.count(priority, -1)
+            raise
+        metrics.observe(f'synthesis_wait_seconds.{priority}', time.monotonic() - started)
+
+    def release(self):
+        self.free += 1
+        self.dispatch()
+
+    def slot(self, user_id, priority='export', cost=1, weight=None):
+        return Slot(self, user_id, priority, cost, weight)
+
+
+class Slot:
+    def __init__(self, queue, *args):
+        self.queue = queue
+        self.args = args
+
+    async def __aenter__(self):
+        await self.queue.acquire(*self.args)
+
+    async def __aexit__(self, *exc):
+        self.queue.release()
@@ -0,0 +1,313 @@
+# ingest.py
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from tempfile import NamedTemporaryFile
+from uuid import uuid4
+from fastapi import HTTPException
+from app.db import supabase
+from app.config import S3_BUCKET_NAME, INGEST_WORKERS, INGEST_LEASE_SECONDS, INGEST_MAX_ATTEMPTS
+from app.s3 import copy_object, delete_object, download_fileobj
+from app.utils import sha256_file, TEXT_FILE_TYPES
+from app.extract_cache import extract_document_cached
+from app.segment import choose_chapters
+from app.text_store import store_text, iter_range, iter_stripped
+
+executor = ThreadPoolExecutor(max_workers=INGEST_WORKERS, thread_name_prefix="ingest")
+
+# Uploaded files are content-addressed per user: the object lives under
+# {user}/blobs/{sha256} and the blobs table remembers its extracted text, so
+# re-uploading the same document reuses both instead of storing and parsing
+# it again.
+
+def blob_path(user_id, sha256):
+    return f"{user_id}/blobs/{sha256}"
+
+def staging_path(user_id, filename):
+    return f"{user_id}/uploads/{uuid4().hex}/{filename}"
+
+def find_blob(user_id, sha256):
+    response = supabase.table('blobs') \
+                .select() \
+                .match({'user_id': user_id, 'sha256': sha256}) \
+                .execute()
+
+    if response and response.get('data'):
+        return response['data'][0]
+    return None
+
+def insert_blob(user_id, sha256, s3_path, content_type, size, path=None):
+    record = {
+        'user_id': user_id,
+        'sha256': sha256,
+        'file_path': s3_path,
+        'type': content_type,
+        'size': size,
+    }
+
+    # Extract text and split it into chapters if it's a PDF or DOCX file.
+    # The text itself goes to S3; the row keeps pointers to it. Each chapter
+    # is read back from there a window at a time and stored on its own.
+    if content_type in TEXT_FILE_TYPES and path is not None:
+        extracted = extract_document_cached(path, content_type, sha256)
+        chapters = choose_chapters(extracted['text_length'], extracted['offsets'],
+                                   extracted['headings'], extracted['boundaries'])
+        for chapter in chapters:
+            chapter.update(store_text(iter_stripped(
+                iter_range(extracted['text_sha256'], chapter['start'], chapter['end']))))
+        record.update({
+            'text_path': extracted['text_path'],
+            'text_sha256': extracted['text_sha256'],
+            'text_length': extracted['text_length'],
+            'block_offsets': extracted['offsets'],
+            'chapters': chapters,
+            'num_characters': extracted['text_length'],
+        })
+
+    blob_response = supabase.table('blobs').insert(record, upsert=True).execute()
+
+    if not blob_response or not blob_response.get('data'):
+        raise HTTPException(status_code=400, detail="Failed to insert blob.")
+
+    return blob_response['data'][0]
+
+def promote_blob(user_id, staged_path, sha256, content_type, size, path=None):
+    # Move an object uploaded under a staging key to its content address, or
+    # drop it if this user already has the same bytes stored.
+    s3_path = blob_path(user_id, sha256)
+    blob = find_blob(user_id, sha256)
+    if blob is None:
+        if staged_path != s3_path:
+            copy_object(S3_BUCKET_NAME, staged_path, s3_path)
+        blob = insert_blob(user_id, sha256, s3_path, content_type, size, path)
+    if staged_path != blob['file_path']:
+        delete_object(S3_BUCKET_NAME, staged_path)
+    return blob
+
+def insert_file(user_id, project_id, filename, blob):
+    record = {
+        'name': filename,
+        'type': blob['type'],
+        'size': blob['size'],
+        'user_id': user_id,
+        'project_id': project_id,
+        'file_path': blob['file_path'],
+        'sha256': blob['sha256'],
+        'text_path': blob.get('text_path'),
+        'text_sha256': blob.get('text_sha256'),
+        'text_length': blob.get('text_length'),
+    }
+    file_response = supabase.table('files').insert(record).execute()
+
+    if not file_response or not file_response.get('data'):
+        raise HTTPException(status_code=400, detail="Failed to insert file.")
+
+    file_id = file_response['data'][0]['id']
+    chapters = insert_chapters(user_id, project_id, file_id, filename, blob)
+
+    return {
+        "id": file_id,
+        "path": blob['file_path'],
+        "sha256": blob['sha256'],
+        "chapters": chapters,
+    }
+
+def update_file_text(file, text):
+    # Store an edited text and point the file at it. The old text stays in
+    # S3 under its own hash, which is what the previous synthesis manifest
+    # refers to.
+    pointers = store_text(text)
+    response = supabase.table('files') \
+                .update(pointers) \
+                .match({'id': file['id']}) \
+                .execute()
+
+    if not response or not response.get('data'):
+        raise HTTPException(status_code=400, detail="Failed to update file text.")
+
+    supabase.table('project_files') \
+        .update({'num_characters': pointers['text_length'], 'modified_at': datetime.now().isoformat()}) \
+        .match({'file_id': file['id']}) \
+        .execute()
+
+    return {**file, **pointers}
+
+def next_sequence(project_id):
+    response = supabase.table('project_files') \
+                .select('sequencing') \
+                .match({'project_id': project_id}) \
+                .order('sequencing', desc=True) \
+                .limit(1) \
+                .execute()
+
+    if response and response.get('data') and response['data'][0]['sequencing'] is not None:
+        return response['data'][0]['sequencing'] + 1
+    return 0
+
+def insert_chapters(user_id, project_id, file_id, filename, blob):
+    # Each chapter becomes its own text file linked into the project, so
+    # synthesis and the reorder editor can work a chapter at a time. Both
+    # tables get a single batched insert. Chapters with no text (nothing
+    # but whitespace, or a document with no text layer) are left out, so a
+    # textless upload is just the file itself.
+    chapters = [chapter for chapter in blob.get('chapters') or [] if chapter['text_length']]
+    if not chapters:
+        return []
+
+    records = []
+    for chapter in chapters:
+        records.append({
+            'name': chapter['title'] or (filename if len(chapters) == 1 else "Front matter"),
+            'type': 'text/plain',
+            'user_id': user_id,
+            'project_id': project_id,
+            'source_file': file_id,
+            'text_path': chapter['text_path'],
+            'text_sha256': chapter['text_sha256'],
+            'text_length': chapter['text_length'],
+        })
+    chapter_response = supabase.table('files').insert(records).execute()
+
+    if not chapter_response or not chapter_response.get('data'):
+        raise HTTPException(status_code=400, detail="Failed to insert chapters.")
+
+    sequence = next_sequence(project_id)
+    modified_at = datetime.now().isoformat()
+    project_files = [
+        {
+            'file_id': row['id'],
+            'project_id': project_id,
+            'sequencing': sequence + i,
+            'num_characters': record['text_length'],
+            'modified_at': modified_at,
+        }
+        for i, (row, record) in enumerate(zip(chapter_response['data'], records))
+    ]
+    supabase.table('project_files').insert(project_files).execute()
+
+    return [{'file_id': pf['file_id'], 'title': record['name'], 'num_characters': pf['num_characters']}
+            for pf, record in zip(project_files, records)]
+
+# Ingest jobs
+#
+# The upload request only stores the bytes in S3 and records a job; text
+# extraction, character counting and the DB inserts run on the worker pool,
+# so request latency does not depend on the size of the manuscript.
+#
+# The pool lives in one process, so a job's row is the record of who is
+# working on it: a worker claims the job by bumping its attempt count
+# (compare-and-swap on the count it read) and keeps a lease alive with
+# every stage update. On startup, jobs left queued or with a lapsed lease
+# by a process that went away are submitted again, or failed once they
+# have been tried INGEST_MAX_ATTEMPTS times.
+
+def create_ingest_job(user_id, project_id, filename, content_type, size, s3_path, sha256=None):
+    record = {
+        'user_id': user_id,
+        'project_id': project_id,
+        'filename': filename,
+        'content_type': content_type,
+        'size': size,
+        'file_path': s3_path,
+        'sha256': sha256,
+        'status': 'queued',
+        'progress': 0,
+        'attempts': 0,
+        'lease_expires': 0,
+    }
+    job_response = supabase.table('ingest_jobs').insert(record).execute()
+
+    if not job_response or not job_response.get('data'):
+        raise HTTPException(status_code=400, detail="Failed to create ingest job.")
+
+    job = job_response['data'][0]
+    executor.submit(run_ingest_job, job)
+    return job
+
+def update_ingest_job(job_id, **fields):
+    supabase.table('ingest_jobs') \
+        .update(fields) \
+        .match({'id': job_id}) \
+        .execute()
+
+def get_ingest_job(job_id, user_id):
+    response = supabase.table('ingest_jobs') \
+                .select() \
+                .match({'id': job_id, 'user_id': user_id}) \
+                .execute()
+
+    if not response or not response.get('data'):
+        raise HTTPException(status_code=404, detail="Ingest job not found.")
+
+    return response['data'][0]
+
+def is_staged(s3_path):
+    # Uploads land under a staging key before they become a blob
+    return s3_path.split('/')[1:2] == ['uploads']
+
+def claim_ingest_job(job):
+    attempts = job.get('attempts') or 0
+    response = supabase.table('ingest_jobs') \
+                .update({'status': 'running', 'attempts': attempts + 1,
+                         'lease_expires': time.time() + INGEST_LEASE_SECONDS}) \
+                .match({'id': job['id'], 'status': job['status'], 'attempts': attempts}) \
+                .execute()
+    return bool(response and response.get('data'))
+
+def advance_ingest_job(job, **fields):
+    update_ingest_job(job['id'], lease_expires=time.time() + INGEST_LEASE_SECONDS, **fields)
+
+def fail_ingest_job(job, detail):
+    update_ingest_job(job['id'], status='failed', stage=None, progress=0, error=detail, lease_expires=0)
+    # Nothing will retry the job, so its upload is no longer needed
+    if is_staged(job['file_path']):
+        try:
+            delete_object(S3_BUCKET_NAME, job['file_path'])
+        except HTTPException:
+            pass
+
+def run_ingest_job(job):
+    if not claim_ingest_job(job):
+        # Another worker got to it first
+        return
+    try:
+        advance_ingest_job(job, stage='deduplicating', progress=10)
+        blob = None
+        if job['sha256']:
+            blob = find_blob(job['user_id'], job['sha256'])
+
+        if blob is None:
+            advance_ingest_job(job, stage='extracting', progress=25)
+            # On disk so the extraction child process can open it
+            with NamedTemporaryFile() as local:
+                download_fileobj(S3_BUCKET_NAME, job['file_path'], local)
+                sha256 = job['sha256'] or sha256_file(local)
+                blob = promote_blob(job['user_id'], job['file_path'], sha256,
+                                    job['content_type'], job['size'], local.name)
+        elif job['file_path'] != blob['file_path']:
+            delete_object(S3_BUCKET_NAME, job['file_path'])
+
+        advance_ingest_job(job, stage='saving', progress=90)
+        file = insert_file(job['user_id'], job['project_id'], job['filename'], blob)
+        update_ingest_job(job['id'], status='completed', stage=None, progress=100, file_id=file['id'],
+                          lease_expires=0)
+    except Exception as e:
+        detail = e.detail if isinstance(e, HTTPException) else str(e)
+        fail_ingest_job(job, detail)
+
+def resume_ingest_jobs():
+    # Pick up jobs a previous process queued or started and never finished
+    response = supabase.table('ingest_jobs') \
+                .select() \
+                .in_('status', ['queued', 'running']) \
+                .execute()
+
+    now = time.time()
+    for job in response.get('data') or []:
+        if (job['lease_expires'] or 0) > now:
+            continue
+        if (job['attempts'] or 0) >= INGEST_MAX_ATTEMPTS:
+            fail_ingest_job(job, "Ingest was interrupted too many times.")
+        else:
+            executor.submit(run_ingest_job, job)
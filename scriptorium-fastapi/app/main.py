@@ -2,8 +2,26 @@
 
 from fastapi import FastAPI
 from app.routes import router as api_router
+from app.elevenlabs import get_client, close_client
+from app.ingest import executor, resume_ingest_jobs
 
 app = FastAPI()
 
 app.include_router(auth_router, prefix="/auth", tags=["auth"])
 app.include_router(api_router, prefix="/api")
+
+
+@app.on_event("startup")
+async def open_clients():
+    get_client()
+
+
+@app.on_event("startup")
+async def resume_jobs():
+    # In the background, so a slow database doesn't hold up startup
+    executor.submit(resume_ingest_jobs)
+
+
+@app.on_event("shutdown")
+async def close_clients():
+    await close_client()
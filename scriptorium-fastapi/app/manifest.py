@@ -0,0 +1,71 @@
+# manifest.py
+
+import json
+from difflib import SequenceMatcher
+from app.config import S3_BUCKET_NAME
+from app.s3 import put_bytes, get_bytes
+
+# Each synthesized chapter has a manifest next to its audio listing the
+# segments it was built from and where each segment's audio is stored.
+# When the chapter is synthesized again, its new segments are diffed
+# against the manifest: segments in unchanged runs reuse their audio and
+# only inserted or rewritten ones go to ElevenLabs. The chunker cuts
+# segments from local boundaries, so an edit changes only the segments
+# around it.
+
+def manifest_path(user_id, project_id, file_id):
+    return f"{user_id}/audio/{project_id}/{file_id}.manifest.json"
+
+def load_manifest(user_id, project_id, file_id):
+    data = get_bytes(S3_BUCKET_NAME, manifest_path(user_id, project_id, file_id))
+    return json.loads(data) if data is not None else None
+
+def store_manifest(user_id, project_id, file_id, manifest):
+    put_bytes(S3_BUCKET_NAME, manifest_path(user_id, project_id, file_id),
+              json.dumps(manifest).encode(), 'application/json')
+
+def diff_segments(previous, segments):
+    # Pair each new segment with the manifest entry whose audio it can
+    # reuse, or None when it has to be synthesized. Also counts what the
+    # edit did, in segments.
+    matcher = SequenceMatcher(None, [entry['id'] for entry in previous],
+                              [segment['id'] for segment in segments], autojunk=False)
+    plan = []
+    stats = {'reused': 0, 'inserted': 0, 'replaced': 0, 'deleted': 0}
+    for op, old_start, old_end, new_start, new_end in matcher.get_opcodes():
+        if op == 'equal':
+            plan.extend(zip(segments[new_start:new_end], previous[old_start:old_end]))
+            stats['reused'] += new_end - new_start
+        else:
+            plan.extend((segment, None) for segment in segments[new_start:new_end])
+            if op == 'insert':
+                stats['inserted'] += new_end - new_start
+            elif op == 'delete':
+                stats['deleted'] += old_end - old_start
+            else:
+                stats['replaced'] += new_end - new_start
+                stats['deleted'] += max(0, (old_end - old_start) - (new_end - new_start))
+    return plan, stats
+
+def build_manifest(chapter, voice_id, settings, audio_file_id, audio_length, entries, stats):
+    # entries are (segment, audio key) in chapter order
+    return {
+        'file_id': chapter['id'],
+        'text_sha256': chapter['text_sha256'],
+        'voice_id': voice_id,
+        'settings': settings,
+        'audio_file_id': audio_file_id,
+        'audio_length': audio_length,
+        'stats': stats,
+        'segments': [
+            {
+                'id': segment['id'],
+                'index': segment['index'],
+                'start': segment['start'],
+                'end': segment['end'],
+                'characters': len(segment['text']),
+                'audio_key': audio_key,
+            }
+            for segment, audio_key in entries
+        ],
+    }
@@ -0,0 +1,40 @@
+# metrics.py
+
+import threading
+from collections import defaultdict
+
+# Process-wide counters, gauges and summaries, read by GET /metrics.
+# Counters only go up; gauges hold the latest value of something like a
+# queue depth; summaries keep the count, total and maximum of observed
+# values such as wait times.
+
+lock = threading.Lock()
+counters = defaultdict(int)
+gauges = {}
+summaries = defaultdict(lambda: {'count': 0, 'sum': 0.0, 'max': 0.0})
+
+def increment(name, value=1):
+    with lock:
+        counters[name] += value
+
+def set_gauge(name, value):
+    with lock:
+        gauges[name] = value
+
+def observe(name, value):
+    with lock:
+        summary = summaries[name]
+        summary['count'] += 1
+        summary['sum'] += value
+        summary['max'] = max(summary['max'], value)
+
+def snapshot():
+    with lock:
+        return {
+            'counters': dict(counters),
+            'gauges': dict(gauges),
+            'summaries': {
+                name: {**summary, 'mean': summary['sum'] / summary['count'] if summary['count'] else 0.0}
+                for name, summary in summaries.items()
+            },
+        }
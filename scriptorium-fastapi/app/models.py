@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Optional
+from typing import List, Optional
 from datetime import datetime
 from uuid import UUID
 
@@ -12,6 +12,17 @@ class File(BaseModel):
     created_at: Optional[datetime] = None
     user_id: Optional[UUID] = None
     speech_sample: Optional[bool] = None
+    project_id: Optional[int] = None
+    source_file: Optional[int] = None
+    file_path: Optional[str] = None
+    sha256: Optional[str] = None
+    text_path: Optional[str] = None
+    text_sha256: Optional[str] = None
+    text_length: Optional[int] = None
+
+
+class FileTextUpdate(BaseModel):
+    text: str
 
 
 class Project(BaseModel):
@@ -24,6 +35,14 @@ class Project(BaseModel):
     cover_image: Optional[int] = None
 
 
+class ProjectCreate(BaseModel):
+    user_id: Optional[UUID] = None
+    title: Optional[str] = None
+    author: Optional[str] = None
+    description: Optional[str] = None
+    cover_image: Optional[int] = None
+
+
 class User(BaseModel):
     user_id: UUID
     email: Optional[str] = None
@@ -54,6 +73,44 @@ class SynthesizedAudio(BaseModel):
     synthesized_audio: Optional[int] = None
     voice_used: Optional[str] = None
     audio_length: Optional[int] = None
+    user_id: Optional[UUID] = None
+    project_id: Optional[int] = None
+    error: Optional[str] = None
+    text_sha256: Optional[str] = None
+    characters: Optional[int] = None
+
+
+class SynthesisCreate(BaseModel):
+    voice_id: str
+    model_id: Optional[str] = None
+    voice_settings: Optional[dict] = None
+    file_ids: Optional[List[int]] = None
+    priority: str = "export"
+
+
+class ProjectEstimate(BaseModel):
+    characters: int
+    billed_characters: int
+    cached_characters: int
+    audio_seconds: int
+    wall_clock_seconds: int
+    queued_requests: int
+    within_quota: bool
+
+
+class SynthesisJob(BaseModel):
+    id: int
+    user_id: Optional[UUID] = None
+    project_id: Optional[int] = None
+    voice_id: Optional[str] = None
+    model_id: Optional[str] = None
+    priority: Optional[str] = None
+    status: Optional[str] = None
+    chapters: Optional[List[dict]] = None
+    segments: Optional[dict] = None
+    error: Optional[str] = None
+    attempts: Optional[int] = None
+    created_at: Optional[datetime] = None
 
 
 class CustomVoice(BaseModel):
@@ -67,3 +124,45 @@ class Export(BaseModel):
     created_at: Optional[datetime] = None
     project_id: Optional[int] = None
     audio_length: Optional[int] = None
+
+
+class UploadSessionCreate(BaseModel):
+    filename: str
+    content_type: str
+    kind: str = "file"
+    project_id: Optional[int] = None
+    size: Optional[int] = None
+    sha256: Optional[str] = None
+
+
+class UploadSession(BaseModel):
+    id: int
+    user_id: Optional[UUID] = None
+    project_id: Optional[int] = None
+    kind: Optional[str] = None
+    filename: Optional[str] = None
+    content_type: Optional[str] = None
+    size: Optional[int] = None
+    file_path: Optional[str] = None
+    upload_id: Optional[str] = None
+    sha256: Optional[str] = None
+    status: Optional[str] = None
+    created_at: Optional[datetime] = None
+    min_part_size: Optional[int] = None
+    max_part_size: Optional[int] = None
+
+
+class IngestJob(BaseModel):
+    id: int
+    user_id: Optional[UUID] = None
+    project_id: Optional[int] = None
+    filename: Optional[str] = None
+    content_type: Optional[str] = None
+    size: Optional[int] = None
+    status: Optional[str] = None
+    stage: Optional[str] = None
+    progress: Optional[int] = None
+    file_id: Optional[int] = None
+    error: Optional[str] = None
+    attempts: Optional[int] = None
+    created_at: Optional[datetime] = None
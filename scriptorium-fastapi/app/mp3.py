@@ -0,0 +1,85 @@
+# mp3.py
+
+# Just enough MPEG audio (Layer III) frame parsing to join segment audio
+# cleanly and time it. Each segment ElevenLabs returns is a complete MP3
+# file: it may start with an ID3v2 tag and a Xing/Info frame describing
+# that file alone, and end with an ID3v1 tag. Left in the middle of a
+# chapter those are junk at best, and a leading Info frame makes players
+# think the whole chapter is one segment long.
+
+BITRATES = {
+    3: [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    2: [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+SAMPLE_RATES = {
+    3: [44100, 48000, 32000],
+    2: [22050, 24000, 16000],
+    0: [11025, 12000, 8000],
+}
+
+
+def parse_header(data, offset):
+    # (frame length, samples, sample rate, side info length) of the Layer III
+    # frame at offset, or None if there isn't one
+    if offset + 4 > len(data) or data[offset] != 0xFF or data[offset + 1] & 0xE0 != 0xE0:
+        return None
+    version = (data[offset + 1] >> 3) & 3
+    layer = (data[offset + 1] >> 1) & 3
+    bitrate_index = data[offset + 2] >> 4
+    rate_index = (data[offset + 2] >> 2) & 3
+    if version == 1 or layer != 1 or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+
+    mpeg1 = version == 3
+    bitrate = BITRATES[3 if mpeg1 else 2][bitrate_index] * 1000
+    sample_rate = SAMPLE_RATES[version][rate_index]
+    padding = (data[offset + 2] >> 1) & 1
+    mono = data[offset + 3] >> 6 == 3
+    length = (144 if mpeg1 else 72) * bitrate // sample_rate + padding
+    side_info = (17 if mono else 32) if mpeg1 else (9 if mono else 17)
+    return length, 1152 if mpeg1 else 576, sample_rate, side_info
+
+
+def id3v2_length(data):
+    if len(data) < 10 or data[:3] != b"ID3":
+        return 0
+    size = (data[6] & 0x7F) << 21 | (data[7] & 0x7F) << 14 | (data[8] & 0x7F) << 7 | data[9] & 0x7F
+    footer = 10 if data[5] & 0x10 else 0
+    return 10 + size + footer
+
+
+def iter_frames(data):
+    # (offset, header) of each frame, skipping anything that isn't one
+    offset = id3v2_length(data)
+    while offset + 4 <= len(data):
+        header = parse_header(data, offset)
+        if header is None:
+            offset = data.find(b"\xff", offset + 1)
+            if offset < 0:
+                return
+            continue
+        yield offset, header
+        offset += header[0]
+
+
+def strip_tags(data):
+    # The audio frames alone: no ID3 tags, no leading Xing/Info/VBRI frame
+    start = id3v2_length(data)
+    end = len(data)
+    if end - start >= 128 and data[end - 128:end - 125] == b"TAG":
+        end -= 128
+
+    header = parse_header(data, start)
+    if header is not None:
+        tag_at = start + 4 + header[3]
+        if data[tag_at:tag_at + 4] in (b"Xing", b"Info") or data[start + 36:start + 40] == b"VBRI":
+            start += header[0]
+
+    if start == 0 and end == len(data):
+        return data
+    return data[start:end]
+
+
+def duration(data):
+    # Seconds of audio in data
+    return sum(samples / sample_rate for _, (_, samples, sample_rate, _) in iter_frames(data))
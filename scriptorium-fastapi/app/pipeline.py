@@ -0,0 +1,95 @@
+# pipeline.py
+
+import asyncio
+import time
+from collections import defaultdict
+from app.config import PIPELINE_QUEUE_SIZE
+from app import metrics
+
+# Runs items through a chain of async stages (for synthesis: call
+# ElevenLabs, post-process the MP3, upload it), each with its own number of
+# workers and a bounded queue in front of it. Each stage keeps working on
+# the next item while later stages deal with earlier ones, so the network,
+# CPU and S3 are busy at the same time instead of in turn. When a stage
+# falls behind, its queue fills and the stages before it wait (backpressure),
+# so no more than a few items' audio is held in memory at once.
+#
+# A stage returns what to hand to the next one, or None to drop the item
+# (e.g. it failed and recorded why). An exception stops the whole run.
+
+DONE = object()
+
+# Items waiting in front of each stage, across all running pipelines
+depths = defaultdict(int)
+
+
+class Stage:
+    def __init__(self, name, func, workers=1):
+        self.name = name
+        self.func = func
+        self.workers = workers
+
+
+def count(stage, change):
+    depths[stage.name] += change
+    metrics.set_gauge(f'pipeline_queue_depth.{stage.name}', depths[stage.name])
+
+
+async def run_pipeline(items, stages, queue_size=PIPELINE_QUEUE_SIZE):
+    queues = [asyncio.Queue(queue_size) for _ in stages]
+    processed = [0] * len(stages)
+    started = time.monotonic()
+
+    async def put(i, item):
+        await queues[i].put(item)
+        if item is not DONE:
+            count(stages[i], 1)
+
+    async def feed():
+        for item in items:
+            await put(0, item)
+
+    async def work(i):
+        stage = stages[i]
+        while True:
+            item = await queues[i].get()
+            if item is DONE:
+                return
+            count(stage, -1)
+            item_started = time.monotonic()
+            result = await stage.func(item)
+            metrics.observe(f'pipeline_stage_seconds.{stage.name}', time.monotonic() - item_started)
+            metrics.increment(f'pipeline_items.{stage.name}')
+            processed[i] += 1
+            if result is not None and i + 1 < len(stages):
+                await put(i + 1, result)
+
+    async def run_stage(i, upstream):
+        # Once everything before this stage has finished, so have its inputs
+        await upstream
+        for _ in range(stages[i].workers):
+            await queues[i].put(DONE)
+
+    tasks = []
+    upstream = asyncio.ensure_future(feed())
+    tasks.append(upstream)
+    for i, stage in enumerate(stages):
+        workers = asyncio.ensure_future(asyncio.gather(*(work(i) for _ in range(stage.workers))))
+        tasks += [workers, asyncio.ensure_future(run_stage(i, upstream))]
+        upstream = workers
+
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        # Whatever a failed run left queued is no longer waiting
+        for queue, stage in zip(queues, stages):
+            while not queue.empty():
+                if queue.get_nowait() is not DONE:
+                    count(stage, -1)
+
+    elapsed = time.monotonic() - started
+    for stage, done in zip(stages, processed):
+        metrics.set_gauge(f'pipeline_items_per_second.{stage.name}', done / elapsed if elapsed else 0.0)
+    return processed
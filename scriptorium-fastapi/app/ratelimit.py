@@ -0,0 +1,141 @@
+# ratelimit.py
+
+import asyncio
+import random
+import time
+import httpx
+from app.config import ELEVEN_REQUESTS_PER_SECOND, ELEVEN_REQUEST_BURST, ELEVEN_MIN_REQUESTS_PER_SECOND, \
+    ELEVEN_MONTHLY_CHARACTERS, ELEVEN_QUOTA_SYNC_INTERVAL, ELEVEN_MAX_RETRIES, ELEVEN_RETRY_BACKOFF
+from app.elevenlabs import ElevenLabsError, get_subscription
+from app import metrics
+
+# All ElevenLabs calls go through one scheduler holding two token buckets:
+# requests per second, and characters out of the monthly quota (refilled
+# evenly over the month and resynced from the account's subscription). A
+# call waits in line until both buckets can cover it instead of failing.
+#
+# The request rate adapts: a 429 halves it and pauses the bucket for the
+# Retry-After period, and every success nudges it back up towards the
+# configured rate, so it settles just under the point where ElevenLabs
+# starts throttling. Server errors and dropped connections are retried a
+# few times after an exponential, jittered backoff without touching the
+# rate.
+
+MONTH_SECONDS = 30 * 24 * 3600
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity, tokens=None):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity if tokens is None else tokens
+        self.updated = time.monotonic()
+        self.paused_until = 0
+        # Waiters queue on the lock, so tokens are handed out first come,
+        # first served
+        self.lock = asyncio.Lock()
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount=1):
+        # Returns how long the caller waited
+        amount = min(amount, self.capacity)
+        started = time.monotonic()
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.refill(now)
+                wait = self.paused_until - now
+                if wait <= 0:
+                    if self.tokens >= amount:
+                        self.tokens -= amount
+                        return now - started
+                    wait = (amount - self.tokens) / self.rate
+                await asyncio.sleep(wait)
+
+    def release(self, amount=1):
+        # Give back tokens for work that never reached upstream
+        self.refill(time.monotonic())
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+    def pause(self, seconds):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+class Scheduler:
+    def __init__(self, requests_per_second, burst, min_requests_per_second, monthly_characters,
+                 max_retries=ELEVEN_MAX_RETRIES, backoff=ELEVEN_RETRY_BACKOFF):
+        self.max_rate = requests_per_second
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.min_rate = min_requests_per_second
+        self.requests = TokenBucket(requests_per_second, burst)
+        self.characters = TokenBucket(monthly_characters / MONTH_SECONDS, monthly_characters)
+        self.synced_at = None
+
+    def throttled(self, retry_after):
+        self.requests.rate = max(self.min_rate, self.requests.rate / 2)
+        self.requests.pause(retry_after if retry_after is not None else 1 / self.requests.rate)
+        metrics.increment('eleven_throttled')
+        metrics.set_gauge('eleven_request_rate', self.requests.rate)
+
+    def succeeded(self):
+        self.requests.rate = min(self.max_rate, self.requests.rate + self.max_rate / 20)
+        metrics.set_gauge('eleven_request_rate', self.requests.rate)
+
+    async def sync_quota(self, client):
+        # Start from what the account actually has left this month
+        if self.synced_at is not None and time.monotonic() - self.synced_at < ELEVEN_QUOTA_SYNC_INTERVAL:
+            return
+        self.synced_at = time.monotonic()
+        subscription = await get_subscription(client)
+        remaining = subscription['character_limit'] - subscription['character_count']
+        self.characters.refill(time.monotonic())
+        self.characters.tokens = max(0, min(self.characters.capacity, remaining))
+        metrics.set_gauge('eleven_characters_available', self.characters.tokens)
+
+    async def retry_later(self, failures):
+        metrics.increment('eleven_retries')
+        await asyncio.sleep(self.backoff * 2 ** (failures - 1) * random.uniform(0.5, 1.5))
+
+    async def call(self, func, characters=0):
+        # Run `func` (a coroutine function making one ElevenLabs request)
+        # once both budgets allow it, retrying when it is throttled
+        if characters:
+            waited = await self.characters.acquire(characters)
+            metrics.increment('eleven_character_wait_seconds', waited)
+        failures = 0
+        try:
+            while True:
+                waited = await self.requests.acquire()
+                metrics.increment('eleven_request_wait_seconds', waited)
+                try:
+                    result = await func()
+                except ElevenLabsError as e:
+                    # A spent monthly quota won't come back by waiting
+                    if e.status_code == 429 and 'quota_exceeded' not in e.detail:
+                        self.throttled(e.retry_after)
+                        continue
+                    if e.status_code < 500 or failures >= self.max_retries:
+                        raise
+                    failures += 1
+                    await self.retry_later(failures)
+                    continue
+                except httpx.TransportError:
+                    if failures >= self.max_retries:
+                        raise
+                    failures += 1
+                    await self.retry_later(failures)
+                    continue
+                self.succeeded()
+                return result
+        except BaseException:
+            if characters:
+                self.characters.release(characters)
+            raise
+
+
+scheduler = Scheduler(ELEVEN_REQUESTS_PER_SECOND, ELEVEN_REQUEST_BURST, ELEVEN_MIN_REQUESTS_PER_SECOND,
+                      ELEVEN_MONTHLY_CHARACTERS)
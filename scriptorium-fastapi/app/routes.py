@@ -1,19 +1,36 @@
-import os
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
-from typing import List
-from app.models import Project, ProjectCreate, File as FileModel, FileOrder
+import base64
+import hashlib
+import json
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, UploadFile, File, Request, Response
+from typing import List, Optional
+from tempfile import SpooledTemporaryFile
+from starlette.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from app.models import Project, ProjectCreate, File as FileModel, UploadSession, UploadSessionCreate, \
+    IngestJob, SynthesizedAudio, SynthesisCreate, SynthesisJob, ProjectEstimate, \
+    FileTextUpdate
 from app.db import supabase
-from supabase import get_current_user
-from .utils import extract_text
-import requests
-import boto3
+from app.deps import get_current_user
+from .utils import check_upload_size, iter_upload, iter_request_body, hash_chunks, sha256_file, FILE_TYPES, \
+    VOICE_SAMPLE_TYPES
+from app.ingest import blob_path, staging_path, find_blob, insert_file, create_ingest_job, get_ingest_job, \
+    update_file_text
+from app.text_store import read_text
+from app import metrics
+from app.elevenlabs import get_client, add_voice
+from app.ratelimit import scheduler
+from app.synthesis import get_project_chapters, get_synthesis_rows, stream_chapter, new_job
+from app.synthesis_jobs import create_synthesis_job, get_synthesis_job, get_job_progress, find_stalled_jobs, \
+    run_synthesis_job
+from app.fairqueue import PRIORITIES
+from app.estimate import estimate_project
+from app.voices import sample_files, download_samples, close_samples
 from datetime import datetime
-from requests_toolbelt.multipart import encoder
-from s3 import upload_file as upload_to_s3
-from config import ELEVEN_API_KEY
-
-s3 = boto3.client('s3', region_name='us-east-1')
-
+from app.s3 import upload_stream, create_multipart_upload, upload_part, list_parts, \
+    complete_multipart_upload, abort_multipart_upload, download_fileobj, generate_presigned_put, \
+    generate_presigned_post, head_object, delete_object
+from app.config import S3_BUCKET_NAME, MAX_UPLOAD_SIZE, MAX_RESUMABLE_UPLOAD_SIZE, \
+    UPLOAD_PART_MIN_SIZE, UPLOAD_PART_MAX_SIZE, PRESIGNED_URL_EXPIRY, TEXT_WINDOW_MAX_CHARS
 
 router = APIRouter()
 
@@ -36,47 +53,88 @@ def get_projects(user: dict = Depends(get_current_user)):
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
-@router.post("/files")
-def upload_file(project_id: int, file: UploadFile = File(...), user: dict = Depends(get_current_user)):
+@router.post("/files", status_code=202, response_model=IngestJob)
+async def upload_file(project_id: int, file: UploadFile = File(...), user: dict = Depends(get_current_user)):
     try:
-        # Check file size
-        if len(file.file.read()) > 10 * 1024 * 1024:  # 10MB limit
-            raise HTTPException(status_code=400, detail="File size exceeds limit")
-
-        # Check file type
-        if file.content_type not in ["application/pdf", "application/vnd.openxmlformats-officedocument.wordprocessingml.document", "image/jpeg", "image/png"]:
+        # Check file size and type before moving any bytes
+        check_upload_size(file.size, MAX_UPLOAD_SIZE)
+        if file.content_type not in FILE_TYPES:
             raise HTTPException(status_code=400, detail="File type not supported")
 
-        # Reset file to start
-        file.file.seek(0)
+        # Hash the spooled upload, counting bytes as they go
+        digest = hashlib.sha256()
+        async for _ in hash_chunks(iter_upload(file, MAX_UPLOAD_SIZE), digest):
+            pass
+        sha256 = digest.hexdigest()
+
+        blob = await run_in_threadpool(find_blob, user['id'], sha256)
+        if blob is None:
+            # New content: stream it to S3 in parts under its content address
+            await file.seek(0)
+            s3_path = blob_path(user['id'], sha256)
+            await upload_stream(iter_upload(file, MAX_UPLOAD_SIZE), S3_BUCKET_NAME, s3_path, file.content_type)
+        else:
+            s3_path = blob['file_path']
+
+        # Extraction and the DB inserts happen on the ingest workers
+        job = await run_in_threadpool(create_ingest_job, user['id'], project_id, file.filename,
+                                      file.content_type, file.size, s3_path, sha256)
+        return job
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-        filename = file.filename
-        s3_path = upload_to_s3(file, project_id)
+@router.post("/files/stream", status_code=202, response_model=IngestJob)
+async def upload_file_stream(project_id: int, filename: str, request: Request, user: dict = Depends(get_current_user)):
+    # Raw-body variant of POST /files: the manuscript is the request body and
+    # is piped to S3 as it arrives, so it is never buffered as a whole. The
+    # hash is only known once the body has been read, so the bytes land on a
+    # staging key and the ingest job moves them to their content address.
+    try:
+        content_type = request.headers.get("content-type")
+        check_upload_size(request.headers.get("content-length"), MAX_UPLOAD_SIZE)
+        if content_type not in FILE_TYPES:
+            raise HTTPException(status_code=400, detail="File type not supported")
 
-        # Extract text if it's a PDF or DOCX file
-        if file.content_type in ["application/pdf", "application/vnd.openxmlformats-officedocument.wordprocessingml.document"]:
-            text_content = extract_text(file)
-        else:
-            text_content = None
+        staged_path = staging_path(user['id'], filename)
+        digest = hashlib.sha256()
+        size = 0
 
-        new_file = FileModel(name=filename, project_id=project_id, text_content=text_content)
-        file_response = supabase.table('files').insert(new_file.dict()).execute()
+        async def counted(chunks):
+            nonlocal size
+            async for chunk in chunks:
+                size += len(chunk)
+                yield chunk
 
-        if not file_response:
-            raise HTTPException(status_code=400, detail="Failed to insert file.")
+        chunks = counted(hash_chunks(iter_request_body(request, MAX_UPLOAD_SIZE), digest))
+        await upload_stream(chunks, S3_BUCKET_NAME, staged_path, content_type)
 
-        return {
-            "id": new_file.id,
-            "path": s3_path
-        }
+        job = await run_in_threadpool(create_ingest_job, user['id'], project_id, filename,
+                                      content_type, size, staged_path, digest.hexdigest())
+        return job
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+@router.get("/ingest-jobs/{job_id}", response_model=IngestJob)
+def get_ingest_job_status(job_id: int, user: dict = Depends(get_current_user)):
+    try:
+        return get_ingest_job(job_id, user['id'])
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+FILE_COLUMNS = ('id', 'name', 'type', 'size', 'created_at', 'user_id', 'project_id', 'source_file',
+                'file_path', 'sha256', 'text_path', 'text_sha256', 'text_length')
+
 @router.get("/files")
 def get_files(project_id: int, user: dict = Depends(get_current_user)):
     try:
         files = supabase.table('files') \
-                    .select() \
+                    .select(*FILE_COLUMNS) \
                     .match({'project_id': project_id, 'user_id': user['id']}) \
                     .execute()
 
@@ -87,34 +145,90 @@ def get_files(project_id: int, user: dict = Depends(get_current_user)):
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
-# Voice samples endpoints
+def get_file(file_id, user):
+    response = supabase.table('files') \
+                .select(*FILE_COLUMNS) \
+                .match({'id': file_id, 'user_id': user['id']}) \
+                .execute()
 
-@router.post("/voice-samples")
-def upload_voice_sample(file: UploadFile = File(...), user: dict = Depends(get_current_user)):
+    if not response or not response.get('data'):
+        raise HTTPException(status_code=404, detail="File not found.")
+
+    return response['data'][0]
+
+@router.get("/files/{file_id}/text")
+def get_file_text(request: Request, response: Response, file_id: int, offset: int = 0,
+                  length: int = 64 * 1024, user: dict = Depends(get_current_user)):
     try:
-        # Check file size
-        if len(file.file.read()) > 10 * 1024 * 1024:  # 10MB limit
-            raise HTTPException(status_code=400, detail="File size exceeds limit")
+        file = get_file(file_id, user)
+        if not file['text_sha256']:
+            raise HTTPException(status_code=404, detail="File has no text.")
+        if offset < 0 or length < 0:
+            raise HTTPException(status_code=400, detail="Offset and length must not be negative.")
+        length = min(length, TEXT_WINDOW_MAX_CHARS)
+
+        # A window of a given text never changes, so the ETag is just the
+        # text hash and the window; an edited file gets a new text hash
+        etag = f'"{file["text_sha256"]}:{offset}:{length}"'
+        if request.headers.get('if-none-match') == etag:
+            return Response(status_code=304, headers={'ETag': etag})
+        response.headers['ETag'] = etag
+        response.headers['Cache-Control'] = "private, no-cache"
+
+        text = read_text(file['text_sha256'], offset, length)
+        return {
+            "offset": offset,
+            "length": len(text),
+            "total_length": file['text_length'],
+            "text": text,
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-        # Check file type
-        if file.content_type not in ["audio/mpeg", "audio/wav"]:
-            raise HTTPException(status_code=400, detail="File type not supported")
+@router.put("/files/{file_id}/text", response_model=FileModel)
+def put_file_text(file_id: int, update: FileTextUpdate, user: dict = Depends(get_current_user)):
+    # Replace a chapter's text. Synthesizing the chapter again only redoes
+    # the segments the edit touched.
+    try:
+        file = get_file(file_id, user)
+        if not file['text_sha256']:
+            raise HTTPException(status_code=400, detail="File has no text.")
+        return update_file_text(file, update.text)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-        # Reset file to start
-        file.file.seek(0)
+# Voice samples endpoints
 
-        s3_path = upload_to_s3(file, user['id'])
+def insert_voice_sample(user, s3_path):
+    record = {'user_id': user['id'], 'file_path': s3_path}
 
-        record = {'user_id': user['id'], 'file_path': s3_path}
+    sample_response = supabase.table('voice_samples').insert(record).execute()
 
-        sample_response = supabase.table('voice_samples').insert(record).execute()
+    if not sample_response:
+        raise HTTPException(status_code=400, detail="Failed to insert voice sample.")
 
-        if not sample_response:
-            raise HTTPException(status_code=400, detail="Failed to insert voice sample.")
+    return {
+        "path": s3_path
+    }
 
-        return {
-            "path": s3_path
-        }
+@router.post("/voice-samples")
+async def upload_voice_sample(file: UploadFile = File(...), user: dict = Depends(get_current_user)):
+    try:
+        # Check file size and type before moving any bytes
+        check_upload_size(file.size, MAX_UPLOAD_SIZE)
+        if file.content_type not in VOICE_SAMPLE_TYPES:
+            raise HTTPException(status_code=400, detail="File type not supported")
+
+        s3_path = f"{user['id']}/voice-samples/{file.filename}"
+        await upload_stream(iter_upload(file, MAX_UPLOAD_SIZE), S3_BUCKET_NAME, s3_path, file.content_type)
+
+        return insert_voice_sample(user, s3_path)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
@@ -133,52 +247,404 @@ def get_voice_samples(user: dict = Depends(get_current_user)):
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
-@router.post("/voice-clone")
-async def create_voice_clone(voice_name: str, user: dict = Depends(get_current_user)):
+# Resumable and presigned upload endpoints
+#
+# A resumable session maps onto an S3 multipart upload: each PUT of a
+# numbered chunk becomes one part, and S3 is the record of which parts have
+# arrived, so an upload can be resumed from any worker after a dropped
+# connection. A presigned session has no multipart upload; the client sends
+# the bytes straight to S3 and the completion call verifies the object.
+#
+# Every part but the last must be at least UPLOAD_PART_MIN_SIZE, or S3
+# refuses to complete the upload. Sessions tell the client the part size
+# limits, and a part that breaks the rule is refused as soon as that is
+# known rather than after everything has been uploaded.
+
+PART_LIMITS = {'min_part_size': UPLOAD_PART_MIN_SIZE, 'max_part_size': UPLOAD_PART_MAX_SIZE}
+
+def get_upload_session(upload_id, user):
+    response = supabase.table('upload_sessions') \
+                .select() \
+                .match({'id': upload_id, 'user_id': user['id']}) \
+                .execute()
+
+    if not response or not response.get('data'):
+        raise HTTPException(status_code=404, detail="Upload session not found.")
+
+    return response['data'][0]
+
+def upload_path(upload, user):
+    check_upload_size(upload.size, MAX_RESUMABLE_UPLOAD_SIZE)
+    if upload.kind == "file":
+        if upload.project_id is None:
+            raise HTTPException(status_code=400, detail="project_id is required for files")
+        if upload.content_type not in FILE_TYPES:
+            raise HTTPException(status_code=400, detail="File type not supported")
+        return staging_path(user['id'], upload.filename)
+    elif upload.kind == "voice_sample":
+        if upload.content_type not in VOICE_SAMPLE_TYPES:
+            raise HTTPException(status_code=400, detail="File type not supported")
+        return f"{user['id']}/voice-samples/{upload.filename}"
+    else:
+        raise HTTPException(status_code=400, detail="Unknown upload kind")
+
+def insert_upload_session(record):
+    session_response = supabase.table('upload_sessions').insert(record).execute()
+
+    if not session_response or not session_response.get('data'):
+        raise HTTPException(status_code=400, detail="Failed to create upload session.")
+
+    return session_response['data'][0]
+
+@router.post("/uploads", response_model=UploadSession)
+def create_upload_session(upload: UploadSessionCreate, user: dict = Depends(get_current_user)):
     try:
-        # Fetch all the files associated with the user and marked as speech_sample=true
-        files_response = supabase.table('file') \
-                            .select('*') \
-                            .match({'user_id': user['user_id'], 'speech_sample': True}) \
-                            .execute()
+        s3_path = upload_path(upload, user)
+        s3_upload_id = create_multipart_upload(S3_BUCKET_NAME, s3_path, upload.content_type)
+
+        record = {
+            **upload.dict(),
+            'user_id': user['id'],
+            'file_path': s3_path,
+            'upload_id': s3_upload_id,
+            'status': 'open',
+        }
+        try:
+            return {**insert_upload_session(record), **PART_LIMITS}
+        except Exception:
+            abort_multipart_upload(S3_BUCKET_NAME, s3_path, s3_upload_id)
+            raise
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-        if not files_response or 'data' not in files_response:
-            raise HTTPException(status_code=400, detail="Failed to retrieve voice samples.")
+@router.post("/uploads/presign")
+def create_presigned_upload(upload: UploadSessionCreate, method: str = "put", user: dict = Depends(get_current_user)):
+    try:
+        s3_path = upload_path(upload, user)
+
+        if upload.kind == "file" and upload.sha256:
+            # Nothing to upload if this user already stored these bytes
+            blob = find_blob(user['id'], upload.sha256.lower())
+            if blob is not None:
+                return {"session": None, "duplicate": True,
+                        "file": insert_file(user['id'], upload.project_id, upload.filename, blob)}
+
+        if method == "put":
+            # S3 checks the body against the signed size and checksum
+            checksum = base64.b64encode(bytes.fromhex(upload.sha256)).decode() if upload.sha256 else None
+            presigned = {
+                "url": generate_presigned_put(S3_BUCKET_NAME, s3_path, upload.content_type, upload.size,
+                                              checksum, PRESIGNED_URL_EXPIRY),
+                "headers": {"Content-Type": upload.content_type},
+            }
+            if checksum:
+                presigned["headers"]["x-amz-checksum-sha256"] = checksum
+        elif method == "post":
+            presigned = generate_presigned_post(S3_BUCKET_NAME, s3_path, upload.content_type,
+                                                upload.size or MAX_RESUMABLE_UPLOAD_SIZE, PRESIGNED_URL_EXPIRY)
+        else:
+            raise HTTPException(status_code=400, detail="method must be 'put' or 'post'")
+
+        record = {
+            **upload.dict(),
+            'user_id': user['id'],
+            'file_path': s3_path,
+            'upload_id': None,
+            'status': 'open',
+        }
+        session = insert_upload_session(record)
 
-        files = []
-        # For each file, download it from S3 and add it to the files list
-        for file in files_response['data']:
-            file_path = file['name']  # Replace 'name' with the actual column name for the file path in S3
-            s3_file = s3.download_file('scriptorium-app', file_path)
-            files.append(('file', (file_path, open(s3_file, 'rb'), 'audio/mpeg')))
+        return {"session": session, "duplicate": False, "method": method, **presigned}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-        # Set the URL for the API endpoint
-        url = "https://api.elevenlabs.io/v1/voices/add"
+@router.get("/uploads/{upload_id}")
+def get_upload(upload_id: int, user: dict = Depends(get_current_user)):
+    try:
+        session = get_upload_session(upload_id, user)
+        parts = []
+        if session['status'] == 'open' and session['upload_id']:
+            parts = list_parts(S3_BUCKET_NAME, session['file_path'], session['upload_id'])
 
-        # Set the headers for the request
-        headers = {
-            "accept": "application/json",
-            "xi-api-key": os.getenv("ELEVEN_API_KEY"),
+        return {
+            "session": {**session, **PART_LIMITS} if session['upload_id'] else session,
+            "parts": [{"part_number": p['PartNumber'], "size": p['Size']} for p in parts],
+            "received": sum(p['Size'] for p in parts),
         }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def check_part_size(session, part_number, size):
+    # Reject a part that is too small to be anything but the last, or that
+    # follows one that was. Only small parts, or later parts of a session
+    # with no declared size, need the parts S3 already has.
+    if size >= UPLOAD_PART_MIN_SIZE and (part_number == 1 or session['size']):
+        return
+    others = [p for p in list_parts(S3_BUCKET_NAME, session['file_path'], session['upload_id'])
+              if p['PartNumber'] != part_number]
+    small = [p['PartNumber'] for p in others
+             if p['PartNumber'] < part_number and p['Size'] < UPLOAD_PART_MIN_SIZE]
+    if small:
+        raise HTTPException(status_code=400, detail=f"Part {small[0]} is smaller than {UPLOAD_PART_MIN_SIZE} "
+                                                    f"bytes but is not the last part.")
+    if size < UPLOAD_PART_MIN_SIZE:
+        later = any(p['PartNumber'] > part_number for p in others)
+        short = session['size'] and sum(p['Size'] for p in others) + size < session['size']
+        if later or short:
+            raise HTTPException(status_code=400, detail=f"Parts other than the last must be at least "
+                                                        f"{UPLOAD_PART_MIN_SIZE} bytes.")
+
+@router.put("/uploads/{upload_id}/parts/{part_number}")
+async def put_upload_part(upload_id: int, part_number: int, request: Request, user: dict = Depends(get_current_user)):
+    try:
+        if not 1 <= part_number <= 10000:
+            raise HTTPException(status_code=400, detail="Part number must be between 1 and 10000")
+        check_upload_size(request.headers.get("content-length"), UPLOAD_PART_MAX_SIZE)
+
+        session = await run_in_threadpool(get_upload_session, upload_id, user)
+        if session['status'] != 'open' or not session['upload_id']:
+            raise HTTPException(status_code=409, detail="Upload session is not open.")
+
+        # Spool the chunk so memory per request stays bounded by the spool
+        # size rather than the part size
+        with SpooledTemporaryFile(max_size=1024 * 1024) as spooled:
+            async for chunk in iter_request_body(request, UPLOAD_PART_MAX_SIZE):
+                spooled.write(chunk)
+            size = spooled.tell()
+            spooled.seek(0)
+            await run_in_threadpool(check_part_size, session, part_number, size)
+            part = await run_in_threadpool(upload_part, S3_BUCKET_NAME, session['file_path'],
+                                           session['upload_id'], part_number, spooled)
+
+        return {"part_number": part_number, "etag": part['ETag'], "size": size}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def finish_multipart_upload(session):
+    parts = list_parts(S3_BUCKET_NAME, session['file_path'], session['upload_id'])
+    if not parts or [p['PartNumber'] for p in parts] != list(range(1, len(parts) + 1)):
+        raise HTTPException(status_code=400, detail="Upload is missing parts.")
+    small = [p['PartNumber'] for p in parts[:-1] if p['Size'] < UPLOAD_PART_MIN_SIZE]
+    if small:
+        raise HTTPException(status_code=400, detail=f"Part {small[0]} is smaller than {UPLOAD_PART_MIN_SIZE} "
+                                                    f"bytes but is not the last part.")
+    size = sum(p['Size'] for p in parts)
+    check_upload_size(size, MAX_RESUMABLE_UPLOAD_SIZE)
+
+    complete_multipart_upload(S3_BUCKET_NAME, session['file_path'], session['upload_id'],
+                              [{'PartNumber': p['PartNumber'], 'ETag': p['ETag']} for p in parts])
+    return size
+
+def verify_presigned_upload(session):
+    # The client wrote the object directly, so check it against what the
+    # session declared and drop it if it does not match.
+    obj = head_object(S3_BUCKET_NAME, session['file_path'])
+    size = obj['ContentLength']
+    error = None
+    if size > MAX_RESUMABLE_UPLOAD_SIZE or (session['size'] and size != session['size']):
+        error = "Uploaded size does not match."
+    elif obj.get('ContentType') != session['content_type']:
+        error = "Uploaded content type does not match."
+    elif session['sha256']:
+        if obj.get('ChecksumSHA256'):
+            checksum = base64.b64decode(obj['ChecksumSHA256']).hex()
+        else:
+            with SpooledTemporaryFile(max_size=1024 * 1024) as spooled:
+                checksum = sha256_file(download_fileobj(S3_BUCKET_NAME, session['file_path'], spooled))
+        if checksum != session['sha256'].lower():
+            error = "Uploaded checksum does not match."
+
+    if error:
+        delete_object(S3_BUCKET_NAME, session['file_path'])
+        raise HTTPException(status_code=400, detail=error)
+    return size
+
+@router.post("/uploads/{upload_id}/complete")
+def complete_upload(upload_id: int, response: Response, user: dict = Depends(get_current_user)):
+    try:
+        session = get_upload_session(upload_id, user)
+        if session['status'] != 'open':
+            raise HTTPException(status_code=409, detail="Upload session is not open.")
+
+        if session['upload_id']:
+            size = finish_multipart_upload(session)
+        else:
+            size = verify_presigned_upload(session)
+
+        supabase.table('upload_sessions') \
+            .update({'status': 'completed', 'size': size}) \
+            .match({'id': upload_id}) \
+            .execute()
+
+        if session['kind'] == 'voice_sample':
+            return insert_voice_sample(user, session['file_path'])
+
+        # Only a presigned upload's checksum has been verified against the object
+        sha256 = session['sha256'] if not session['upload_id'] else None
+        job = create_ingest_job(user['id'], session['project_id'], session['filename'],
+                                session['content_type'], size, session['file_path'], sha256)
+        response.status_code = 202
+        return job
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.delete("/uploads/{upload_id}")
+def abort_upload(upload_id: int, user: dict = Depends(get_current_user)):
+    try:
+        session = get_upload_session(upload_id, user)
+        if session['status'] == 'open':
+            if session['upload_id']:
+                abort_multipart_upload(S3_BUCKET_NAME, session['file_path'], session['upload_id'])
+            supabase.table('upload_sessions') \
+                .update({'status': 'aborted'}) \
+                .match({'id': upload_id}) \
+                .execute()
+
+        return {"id": upload_id, "status": "aborted"}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+# Synthesis endpoints
+
+@router.post("/projects/{project_id}/synthesize", status_code=202, response_model=SynthesisJob)
+async def synthesize(project_id: int, synthesis: SynthesisCreate, background_tasks: BackgroundTasks,
+                     user: dict = Depends(get_current_user)):
+    try:
+        if synthesis.priority not in PRIORITIES:
+            raise HTTPException(status_code=400, detail="Priority must be one of: " + ", ".join(PRIORITIES))
+
+        chapters = await run_in_threadpool(get_project_chapters, project_id, user['id'], synthesis.file_ids)
+        if not chapters:
+            raise HTTPException(status_code=400, detail="Project has no text to synthesize.")
+
+        # The job is worked on after the response is sent, for as long as
+        # this invocation allows; POST /synthesis-jobs/resume picks it up
+        # again if it needs longer
+        job = new_job(user['id'], project_id, synthesis.voice_id, synthesis.model_id, synthesis.voice_settings,
+                      synthesis.priority)
+        job = await run_in_threadpool(create_synthesis_job, job, chapters)
+        background_tasks.add_task(run_synthesis_job, job['id'])
+        return job
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/projects/{project_id}/estimate", response_model=ProjectEstimate)
+def get_synthesis_estimate(project_id: int, voice_id: str, priority: str = "export", model_id: Optional[str] = None,
+                           voice_settings: Optional[str] = None, user: dict = Depends(get_current_user)):
+    # What synthesizing the project would cost and take, from stored
+    # aggregates only, so it can be shown before the author commits.
+    # voice_settings is the same object POST /synthesize takes, JSON-encoded.
+    try:
+        if priority not in PRIORITIES:
+            raise HTTPException(status_code=400, detail="Priority must be one of: " + ", ".join(PRIORITIES))
+        settings = json.loads(voice_settings) if voice_settings else None
+        return estimate_project(project_id, user['id'], voice_id, priority, model_id, settings)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-        # Prepare the data for the request
-        data = {"name": voice_name}
+@router.get("/synthesis-jobs/{job_id}", response_model=SynthesisJob)
+def get_synthesis_job_status(job_id: int, user: dict = Depends(get_current_user)):
+    try:
+        job = get_synthesis_job(job_id, user['id'])
+        return {**job, 'segments': get_job_progress(job_id)}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-        # Create a multipart encoded form with the files
-        multipart_data = encoder.MultipartEncoder(
-            fields={**data, **{f"file_{i}": (file.filename, file.file, file.content_type) for i, file in enumerate(files)}}
-        )
+@router.post("/synthesis-jobs/resume", status_code=202)
+async def resume_synthesis_jobs(background_tasks: BackgroundTasks, user: dict = Depends(get_current_user)):
+    # Pick up every job of the user's that is between invocations or whose
+    # worker died. Meant to be called on a schedule until nothing is left.
+    try:
+        job_ids = await run_in_threadpool(find_stalled_jobs, user['id'])
+        for job_id in job_ids:
+            background_tasks.add_task(run_synthesis_job, job_id)
+        return {"resumed": job_ids}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-        # Update headers with the correct content type
-        headers["Content-Type"] = multipart_data.content_type
+@router.post("/synthesis-jobs/{job_id}/resume", status_code=202, response_model=SynthesisJob)
+async def resume_synthesis_job(job_id: int, background_tasks: BackgroundTasks,
+                               user: dict = Depends(get_current_user)):
+    try:
+        job = await run_in_threadpool(get_synthesis_job, job_id, user['id'])
+        if job['status'] not in ('completed', 'failed'):
+            background_tasks.add_task(run_synthesis_job, job_id)
+        return job
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-        # Send the request to the API
-        response = requests.post(url, headers=headers, data=multipart_data)
+@router.get("/files/{file_id}/audio/stream")
+async def stream_file_audio(file_id: int, voice_id: str, model_id: Optional[str] = None,
+                            user: dict = Depends(get_current_user)):
+    # Play a chapter while it is being synthesized: the MP3 is streamed back
+    # segment by segment, at preview priority
+    try:
+        file = await run_in_threadpool(get_file, file_id, user)
+        if not file['text_sha256']:
+            raise HTTPException(status_code=404, detail="File has no text.")
+
+        job = new_job(user['id'], file['project_id'], voice_id, model_id, priority='preview')
+        return StreamingResponse(stream_chapter(job, file), media_type="audio/mpeg")
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-        # Check if the request was successful
-        if response.status_code != 200:
-            raise HTTPException(status_code=400, detail="Failed to clone voice.")
-        voice_id = response.json().get("voice_id")
+@router.get("/projects/{project_id}/synthesized-audio", response_model=List[SynthesizedAudio])
+def get_synthesized_audio(project_id: int, user: dict = Depends(get_current_user)):
+    try:
+        return get_synthesis_rows(project_id, user['id'])
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/metrics")
+def get_metrics():
+    return metrics.snapshot()
+
+@router.post("/voice-clone")
+async def create_voice_clone(voice_name: str, user: dict = Depends(get_current_user)):
+    try:
+        # Fetch every voice sample the user has uploaded
+        samples_response = supabase.table('voice_samples') \
+                            .select('file_path') \
+                            .match({'user_id': user['id']}) \
+                            .execute()
+
+        if not samples_response or 'data' not in samples_response:
+            raise HTTPException(status_code=400, detail="Failed to retrieve voice samples.")
+        if not samples_response['data']:
+            raise HTTPException(status_code=400, detail="No voice samples to clone from.")
+
+        # Download every sample at once, then stream them up together
+        samples = await download_samples(sample_files(samples_response['data']))
+        try:
+            # Send the request to the API once the rate limit allows it
+            voice = await scheduler.call(lambda: add_voice(get_client(), voice_name, samples))
+        finally:
+            close_samples(samples)
+        voice_id = voice.get("voice_id")
 
         if not voice_id:
             raise HTTPException(status_code=400, detail="Failed to get voice_id.")
@@ -187,13 +653,15 @@ async def create_voice_clone(voice_name: str, user: dict = Depends(get_current_u
         new_voice = {
             "voice_id": voice_id,
             "created_at": datetime.now(),
-            "user_id": user['user_id'],
+            "user_id": user['id'],
         }
         voice_response = supabase.table('custom_voice').insert(new_voice).execute()
         if not voice_response:
             raise HTTPException(status_code=400, detail="Failed to insert voice.")
 
         return {"voice_id": voice_id}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
@@ -203,7 +671,7 @@ def get_voices(user: dict = Depends(get_current_user)):
         # Query the user_voices table for all voices of the current user
         user_voices = supabase.table('custom_voice') \
                     .select() \
-                    .match({'user_id': user['user_id']}) \
+                    .match({'user_id': user['id']}) \
                     .execute()
 
         # Format the response data to only return the voice IDs
@@ -1,9 +1,10 @@
 # s3.py
 
 import boto3
-from botocore.exceptions import BotoCoreError, NoCredentialsError
-from app.config import AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY
+from botocore.exceptions import BotoCoreError, ClientError, NoCredentialsError
+from app.config import AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, S3_PART_SIZE
 from fastapi import HTTPException
+from starlette.concurrency import run_in_threadpool
 
 s3 = boto3.client('s3',
                   aws_access_key_id=AWS_ACCESS_KEY_ID,
@@ -20,4 +21,145 @@ def download_file(bucket, key):
         s3.download_file(bucket, key, key)
     except (BotoCoreError, NoCredentialsError) as e:
         raise HTTPException(status_code=400, detail=str(e))
-    
\ No newline at end of file
+
+def create_multipart_upload(bucket, key, content_type=None):
+    extra = {'ContentType': content_type} if content_type else {}
+    try:
+        upload = s3.create_multipart_upload(Bucket=bucket, Key=key, **extra)
+        return upload['UploadId']
+    except (BotoCoreError, ClientError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def upload_part(bucket, key, upload_id, part_number, body):
+    try:
+        part = s3.upload_part(Bucket=bucket, Key=key, UploadId=upload_id,
+                              PartNumber=part_number, Body=body)
+        return {'PartNumber': part_number, 'ETag': part['ETag']}
+    except (BotoCoreError, ClientError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def complete_multipart_upload(bucket, key, upload_id, parts):
+    try:
+        s3.complete_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id,
+                                     MultipartUpload={'Parts': parts})
+    except (BotoCoreError, ClientError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def abort_multipart_upload(bucket, key, upload_id):
+    try:
+        s3.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+    except (BotoCoreError, ClientError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+async def upload_stream(chunks, bucket, key, content_type=None, part_size=S3_PART_SIZE):
+    # Pipe an async iterator of byte chunks into a multipart upload, holding at
+    # most one part in memory. The upload is aborted if the iterator raises
+    # (e.g. because the body went over the size limit).
+    upload_id = await run_in_threadpool(create_multipart_upload, bucket, key, content_type)
+    parts = []
+    buffer = bytearray()
+    try:
+        async for chunk in chunks:
+            buffer += chunk
+            while len(buffer) >= part_size:
+                part = await run_in_threadpool(upload_part, bucket, key, upload_id,
+                                               len(parts) + 1, bytes(buffer[:part_size]))
+                parts.append(part)
+                del buffer[:part_size]
+        if buffer or not parts:
+            part = await run_in_threadpool(upload_part, bucket, key, upload_id,
+                                           len(parts) + 1, bytes(buffer))
+            parts.append(part)
+        await run_in_threadpool(complete_multipart_upload, bucket, key, upload_id, parts)
+    except BaseException:
+        await run_in_threadpool(abort_multipart_upload, bucket, key, upload_id)
+        raise
+    return key
+
+def list_parts(bucket, key, upload_id):
+    try:
+        parts = []
+        marker = 0
+        while True:
+            page = s3.list_parts(Bucket=bucket, Key=key, UploadId=upload_id, PartNumberMarker=marker)
+            parts += [{'PartNumber': p['PartNumber'], 'ETag': p['ETag'], 'Size': p['Size']}
+                      for p in page.get('Parts', [])]
+            if not page.get('IsTruncated'):
+                return parts
+            marker = page['NextPartNumberMarker']
+    except (BotoCoreError, ClientError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def download_fileobj(bucket, key, fileobj):
+    try:
+        s3.download_fileobj(bucket, key, fileobj)
+        fileobj.seek(0)
+        return fileobj
+    except (BotoCoreError, ClientError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def generate_presigned_put(bucket, key, content_type, size=None, checksum_sha256=None, expires=3600):
+    # Signed headers (Content-Type, Content-Length, x-amz-checksum-sha256) must
+    # be sent as-is by the client, so S3 itself rejects a mismatching body.
+    params = {'Bucket': bucket, 'Key': key, 'ContentType': content_type}
+    if size is not None:
+        params['ContentLength'] = size
+    if checksum_sha256:
+        params['ChecksumSHA256'] = checksum_sha256
+    try:
+        return s3.generate_presigned_url('put_object', Params=params, ExpiresIn=expires)
+    except (BotoCoreError, ClientError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def generate_presigned_post(bucket, key, content_type, max_size, expires=3600):
+    try:
+        return s3.generate_presigned_post(
+            bucket, key,
+            Fields={'Content-Type': content_type},
+            Conditions=[{'Content-Type': content_type}, ['content-length-range', 1, max_size]],
+            ExpiresIn=expires)
+    except (BotoCoreError, ClientError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def head_object(bucket, key):
+    try:
+        return s3.head_object(Bucket=bucket, Key=key, ChecksumMode='ENABLED')
+    except (BotoCoreError, ClientError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def delete_object(bucket, key):
+    try:
+        s3.delete_object(Bucket=bucket, Key=key)
+    except (BotoCoreError, ClientError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def copy_object(bucket, source_key, key):
+    try:
+        s3.copy_object(Bucket=bucket, Key=key, CopySource={'Bucket': bucket, 'Key': source_key})
+    except (BotoCoreError, ClientError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def put_bytes(bucket, key, body, content_type=None):
+    extra = {'ContentType': content_type} if content_type else {}
+    try:
+        s3.put_object(Bucket=bucket, Key=key, Body=body, **extra)
+    except (BotoCoreError, ClientError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def get_bytes(bucket, key):
+    # Returns None when the object does not exist
+    try:
+        return s3.get_object(Bucket=bucket, Key=key)['Body'].read()
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+            return None
+        raise HTTPException(status_code=400, detail=str(e))
+    except BotoCoreError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def get_range(bucket, key, start, end):
+    # Bytes start..end of the object, both inclusive
+    try:
+        return s3.get_object(Bucket=bucket, Key=key, Range=f"bytes={start}-{end}")['Body'].read()
+    except (BotoCoreError, ClientError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
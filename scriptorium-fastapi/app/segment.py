@@ -0,0 +1,128 @@
+# segment.py
+
+import re
+
+# Chapters shorter than this are folded into a neighbouring chapter
+MIN_CHAPTER_CHARS = 500
+# A heading is a short line; anything longer is prose that happens to start
+# with "Chapter ..."
+MAX_HEADING_CHARS = 100
+
+NUMBER_WORDS = (
+    "one|two|three|four|five|six|seven|eight|nine|ten|eleven|twelve|thirteen|fourteen|fifteen|"
+    "sixteen|seventeen|eighteen|nineteen|twenty|thirty|forty|fifty"
+)
+HEADING_RE = re.compile(
+    rf"[ \t]*((?:chapter|part|book)[ \t]+(?:\d+|[ivxlcdm]+|(?:(?:{NUMBER_WORDS})[- ]?)+)\b"
+    r"|prologue\b|epilogue\b|preface\b|foreword\b|introduction\b|afterword\b|interlude\b)",
+    re.IGNORECASE)
+
+
+def heading_boundaries(offsets, headings):
+    # Headings found in the document's markup, given as (block index, title)
+    return [(offsets[index], title) for index, title in headings if 0 <= index < len(offsets)]
+
+
+class HeadingScanner:
+    # Finds lines that start like a chapter heading in a text fed to it a
+    # piece at a time, holding only the current line. Blocks are joined by
+    # newlines, so every block starts a line. A heading that shows up more
+    # than once (e.g. in a table of contents and then at the chapter itself)
+    # is only kept at its last occurrence.
+    def __init__(self):
+        self.length = 0
+        self.line_start = 0
+        self.line = []
+        self.found = {}
+
+    def end_line(self):
+        line = "".join(self.line)
+        match = HEADING_RE.match(line)
+        title = line.strip()
+        if match and len(title) <= MAX_HEADING_CHARS:
+            key = " ".join(match.group(1).lower().split())
+            self.found[key] = (self.line_start, title)
+        self.line = []
+
+    def feed(self, text):
+        start = 0
+        while True:
+            newline = text.find("\n", start)
+            if newline == -1:
+                self.line.append(text[start:])
+                break
+            self.line.append(text[start:newline])
+            self.end_line()
+            start = newline + 1
+            self.line_start = self.length + start
+        self.length += len(text)
+
+    def scan(self, pieces):
+        # Pass pieces through, scanning them on the way
+        for piece in pieces:
+            self.feed(piece)
+            yield piece
+
+    def boundaries(self):
+        if self.line:
+            self.end_line()
+        return sorted(self.found.values())
+
+
+def regex_boundaries(text):
+    scanner = HeadingScanner()
+    scanner.feed(text)
+    return scanner.boundaries()
+
+
+def split_chapters(length, boundaries):
+    # Turn (position, title) boundaries into chapter ranges covering the
+    # whole text. Text before the first heading becomes an untitled chapter
+    # when it is long enough to stand alone. A text with nothing in it (a
+    # scanned PDF, say) has no chapters at all.
+    if not length:
+        return []
+    boundaries = sorted(set(boundaries))
+    chapters = []
+    for i, (start, title) in enumerate(boundaries):
+        end = boundaries[i + 1][0] if i + 1 < len(boundaries) else length
+        if end > start:
+            chapters.append({'title': title, 'start': start, 'end': end})
+
+    if not chapters:
+        return [{'title': None, 'start': 0, 'end': length}]
+    if chapters[0]['start'] > 0:
+        chapters.insert(0, {'title': None, 'start': 0, 'end': chapters[0]['start']})
+
+    # Fold chapters too short to stand alone (a "Part One" page, a short
+    # title page) into the chapter that follows; a short last chapter goes
+    # into the one before it
+    merged = []
+    carry = None
+    for chapter in chapters:
+        if carry is not None:
+            chapter['start'] = carry
+            carry = None
+        if chapter['end'] - chapter['start'] < MIN_CHAPTER_CHARS:
+            carry = chapter['start']
+        else:
+            merged.append(chapter)
+    if carry is not None:
+        if not merged:
+            return [{'title': None, 'start': 0, 'end': length}]
+        merged[-1]['end'] = length
+    return merged
+
+
+def choose_chapters(length, offsets, headings, found):
+    # Prefer headings from the document's own structure (DOCX heading styles,
+    # PDF bookmarks) and fall back to the heading-like lines found by a
+    # HeadingScanner
+    boundaries = heading_boundaries(offsets, headings)
+    if len(boundaries) < 2:
+        boundaries = found
+    return split_chapters(length, boundaries)
+
+
+def segment_text(text, offsets, headings):
+    return choose_chapters(len(text), offsets, headings, regex_boundaries(text))
@@ -0,0 +1,195 @@
+# synthesis.py
+
+import asyncio
+import time
+from datetime import datetime
+from fastapi import HTTPException
+from starlette.concurrency import run_in_threadpool
+from app.db import supabase
+from app.config import ELEVEN_MODEL_ID, SYNTHESIS_CONCURRENCY, SYNTHESIS_STREAM_LOOKAHEAD, SYNTHESIS_USER_WEIGHTS
+from app.chunker import iter_segments
+from app.elevenlabs import get_client, text_to_speech
+from app.text_store import iter_text
+from app.audio_cache import cache_key, get_cached_audio, put_cached_audio
+from app.ratelimit import scheduler
+from app.fairqueue import FairQueue
+from app.mp3 import strip_tags
+from app import metrics
+
+# Chapters are split into segments and the segments are sent to ElevenLabs
+# concurrently. Every running synthesis shares one limit on requests in
+# flight, so the total stays inside the account's concurrency quota however
+# many books are being synthesized; the slots are handed out by priority
+# and fair share across users (see fairqueue.py), and requests are paced
+# by the scheduler in ratelimit.py. Segment audio goes through the audio
+# cache, so only segments never synthesized before are paid for.
+#
+# Whole projects are synthesized as durable jobs (see synthesis_jobs.py);
+# this module holds the pieces they share with streaming playback.
+
+
+def user_weight(user_id):
+    return SYNTHESIS_USER_WEIGHTS.get(str(user_id), 1)
+
+
+slots = FairQueue(SYNTHESIS_CONCURRENCY, user_weight)
+
+
+class DeadlineReached(Exception):
+    pass
+
+
+def chapter_audio_path(user_id, project_id, file_id):
+    return f"{user_id}/audio/{project_id}/{file_id}.mp3"
+
+def get_project_chapters(project_id, user_id, file_ids=None):
+    # The project's text files in reading order
+    project = supabase.table('projects') \
+                .select('id') \
+                .match({'id': project_id, 'user_id': user_id}) \
+                .execute()
+
+    if not project or not project.get('data'):
+        raise HTTPException(status_code=404, detail="Project not found.")
+
+    project_files = supabase.table('project_files') \
+                        .select('file_id', 'sequencing') \
+                        .match({'project_id': project_id}) \
+                        .order('sequencing') \
+                        .execute()
+
+    order = [pf['file_id'] for pf in project_files.get('data') or []
+             if file_ids is None or pf['file_id'] in file_ids]
+    if not order:
+        return []
+
+    files = supabase.table('files') \
+                .select('id', 'name', 'text_sha256', 'text_length') \
+                .in_('id', order) \
+                .execute()
+
+    by_id = {f['id']: f for f in files.get('data') or [] if f.get('text_sha256')}
+    return [by_id[file_id] for file_id in order if file_id in by_id]
+
+def create_synthesis_rows(user_id, project_id, chapters, voice_id, settings=None):
+    initiated_at = datetime.now().isoformat()
+    records = [
+        {
+            'user_id': user_id,
+            'project_id': project_id,
+            'source_file': chapter['id'],
+            'voice_used': voice_id,
+            'settings': settings,
+            'initiated_at': initiated_at,
+        }
+        for chapter in chapters
+    ]
+    response = supabase.table('synthesized_audio').insert(records).execute()
+
+    if not response or not response.get('data'):
+        raise HTTPException(status_code=400, detail="Failed to start synthesis.")
+
+    return response['data']
+
+def update_synthesis(row_id, **fields):
+    supabase.table('synthesized_audio') \
+        .update(fields) \
+        .match({'id': row_id}) \
+        .execute()
+
+def get_synthesis_rows(project_id, user_id):
+    response = supabase.table('synthesized_audio') \
+                .select() \
+                .match({'project_id': project_id, 'user_id': user_id}) \
+                .execute()
+    return response.get('data') or []
+
+def save_audio_file(user_id, project_id, chapter, s3_path, size, file_id=None):
+    # A chapter keeps a single audio file; synthesizing it again updates
+    # the existing row
+    if file_id is not None:
+        response = supabase.table('files') \
+                    .update({'size': size, 'file_path': s3_path}) \
+                    .match({'id': file_id, 'user_id': user_id}) \
+                    .execute()
+        if response and response.get('data'):
+            return response['data'][0]
+
+    record = {
+        'name': f"{chapter['name']}.mp3",
+        'type': 'audio/mpeg',
+        'size': size,
+        'user_id': user_id,
+        'project_id': project_id,
+        'source_file': chapter['id'],
+        'file_path': s3_path,
+    }
+    response = supabase.table('files').insert(record).execute()
+
+    if not response or not response.get('data'):
+        raise HTTPException(status_code=400, detail="Failed to insert audio file.")
+
+    return response['data'][0]
+
+def load_segments(text_sha256):
+    return list(iter_segments(iter_text(text_sha256)))
+
+async def fetch_segment(client, job, segment, deadline=None):
+    # (audio, cache key, whether it came from the cache) for a segment
+    key = cache_key(job['voice_id'], job['model_id'], job['voice_settings'], segment['text'])
+    audio = await run_in_threadpool(get_cached_audio, key, len(segment['text']))
+    if audio is not None:
+        return audio, key, True
+
+    async with slots.slot(job['user_id'], job['priority'], cost=len(segment['text'])):
+        # The wait for a slot can be long; don't start a request the worker
+        # has no time left to finish
+        if deadline is not None and time.monotonic() > deadline:
+            raise DeadlineReached()
+        started = time.monotonic()
+        audio = await scheduler.call(
+            lambda: text_to_speech(client, job['voice_id'], segment['text'], job['model_id'], job['voice_settings']),
+            characters=len(segment['text']))
+    metrics.observe('eleven_tts_seconds', time.monotonic() - started)
+    metrics.increment('synthesized_characters', len(segment['text']))
+    return audio, key, False
+
+async def synthesize_segment(client, job, segment, deadline=None):
+    # (audio, cache key) for a segment, from the cache or from ElevenLabs
+    audio, key, cached = await fetch_segment(client, job, segment, deadline)
+    if not cached:
+        audio = strip_tags(audio)
+        await run_in_threadpool(put_cached_audio, key, audio)
+    return audio, key
+
+async def stream_chapter(job, chapter, lookahead=SYNTHESIS_STREAM_LOOKAHEAD):
+    # Yield a chapter's audio segment by segment, in order, as soon as each
+    # is ready. Cached segments come straight back; a few segments past the
+    # one being played are synthesized ahead, so playback doesn't wait on
+    # each request in turn but a listener who stops early doesn't pay for
+    # the whole chapter. Everything synthesized lands in the audio cache.
+    segments = await run_in_threadpool(load_segments, chapter['text_sha256'])
+    client = get_client()
+    pending = []
+    try:
+        for segment in segments:
+            pending.append(asyncio.ensure_future(synthesize_segment(client, job, segment)))
+            if len(pending) > lookahead:
+                audio, _ = await pending.pop(0)
+                yield audio
+        while pending:
+            audio, _ = await pending.pop(0)
+            yield audio
+    finally:
+        for task in pending:
+            task.cancel()
+
+def new_job(user_id, project_id, voice_id, model_id=None, voice_settings=None, priority='export'):
+    return {
+        'user_id': user_id,
+        'project_id': project_id,
+        'voice_id': voice_id,
+        'model_id': model_id or ELEVEN_MODEL_ID,
+        'voice_settings': voice_settings,
+        'priority': priority,
+    }
@@ -0,0 +1,444 @@
+# synthesis_jobs.py
+
+import asyncio
+import os
+import socket
+import time
+from uuid import uuid4
+from fastapi import HTTPException
+from starlette.concurrency import run_in_threadpool
+from app.db import supabase
+from app.config import S3_BUCKET_NAME, SYNTHESIS_CONCURRENCY, SYNTHESIS_CHAPTERS_IN_FLIGHT, SYNTHESIS_TIME_BUDGET, \
+    SYNTHESIS_DEADLINE_MARGIN, SYNTHESIS_LEASE_SECONDS, SYNTHESIS_MAX_ATTEMPTS, SYNTHESIS_JOB_MAX_ATTEMPTS, \
+    PIPELINE_PROCESS_WORKERS, PIPELINE_UPLOAD_WORKERS
+from app.elevenlabs import get_client, ElevenLabsError
+from app.s3 import put_bytes, get_bytes
+from app.audio_cache import settings_hash, put_cached_audio
+from app.manifest import load_manifest, store_manifest, diff_segments, build_manifest
+from app.ratelimit import scheduler
+from app.synthesis import DeadlineReached, chapter_audio_path, create_synthesis_rows, update_synthesis, \
+    save_audio_file, load_segments, fetch_segment
+from app.pipeline import Stage, run_pipeline
+from app.mp3 import strip_tags, duration
+from app import metrics
+
+# A whole-book synthesis doesn't fit in one Lambda invocation, so it runs as
+# a durable job. The synthesis_jobs row holds the job's settings, each
+# chapter's progress and a lease; synthesis_segments holds one row per
+# segment (pending, in_flight, done or failed) with the cache key of its
+# audio once done.
+#
+# A worker takes the lease by compare-and-swap on lease_token, but only
+# once nobody holds it or the holder's lease has expired, and keeps it
+# renewed while it works. Every save checks the token the run claimed the
+# job with. If a renewal finds the lease taken, or one chapter fails, every
+# chapter still running is cancelled before the job is let go. The worker
+# works until its time budget is nearly spent. It
+# then stops starting new requests, lets the ones in flight finish and
+# hands the job back as queued. Whoever runs the job next (a later
+# invocation, or another worker once a crashed worker's lease has expired)
+# carries on from the segment rows. A segment that was in flight when a
+# worker died is tried again, but its audio is looked up in the audio cache
+# first, so a segment that was already paid for is not billed again.
+#
+# A job that fails with an error running it again would only repeat (a 4xx
+# from ElevenLabs such as a missing voice, text that can't be read) is
+# failed straight away. Other errors hand it back as queued, until it has
+# been claimed SYNTHESIS_JOB_MAX_ATTEMPTS times in a row without a run
+# ending cleanly.
+
+WORKER_ID = f"{socket.gethostname()}-{os.getpid()}-{uuid4().hex[:8]}"
+
+# Jobs this process is working on
+running = set()
+
+
+class LeaseLost(Exception):
+    pass
+
+
+def create_synthesis_job(job, chapters):
+    rows = create_synthesis_rows(job['user_id'], job['project_id'], chapters, job['voice_id'],
+                                 settings_hash(job['model_id'], job['voice_settings']))
+    row_ids = {row['source_file']: row['id'] for row in rows}
+    record = {
+        **job,
+        'status': 'queued',
+        'chapters': [
+            {
+                'file_id': chapter['id'],
+                'name': chapter['name'],
+                'text_sha256': chapter['text_sha256'],
+                'row_id': row_ids[chapter['id']],
+                'status': 'pending',
+            }
+            for chapter in chapters
+        ],
+        'lease_token': uuid4().hex,
+        'lease_expires': 0,
+        'attempts': 0,
+    }
+    response = supabase.table('synthesis_jobs').insert(record).execute()
+
+    if not response or not response.get('data'):
+        raise HTTPException(status_code=400, detail="Failed to create synthesis job.")
+
+    return response['data'][0]
+
+def get_synthesis_job(job_id, user_id=None):
+    match = {'id': job_id} if user_id is None else {'id': job_id, 'user_id': user_id}
+    response = supabase.table('synthesis_jobs') \
+                .select() \
+                .match(match) \
+                .execute()
+
+    if not response or not response.get('data'):
+        raise HTTPException(status_code=404, detail="Synthesis job not found.")
+
+    return response['data'][0]
+
+def get_job_progress(job_id):
+    response = supabase.table('synthesis_segments') \
+                .select('status') \
+                .match({'job_id': job_id}) \
+                .execute()
+
+    progress = {'pending': 0, 'in_flight': 0, 'done': 0, 'failed': 0}
+    for segment in response.get('data') or []:
+        progress[segment['status']] += 1
+    return progress
+
+def find_stalled_jobs(user_id):
+    # Jobs handed back between invocations, or whose worker stopped renewing
+    # its lease
+    response = supabase.table('synthesis_jobs') \
+                .select('id', 'status', 'lease_expires') \
+                .match({'user_id': user_id}) \
+                .in_('status', ['queued', 'running']) \
+                .execute()
+
+    return [job['id'] for job in response.get('data') or [] if (job['lease_expires'] or 0) < time.time()]
+
+def swap_lease(job, token, fields):
+    # Update the job only if it is still held under `token`. A token is
+    # set when the job is claimed and replaced when it is released, so a
+    # run's saves stop passing once the run has let go of the job, whatever
+    # the shared job dict says by then.
+    response = supabase.table('synthesis_jobs') \
+                .update(fields) \
+                .match({'id': job['id'], 'lease_token': token}) \
+                .execute()
+
+    if not response or not response.get('data'):
+        raise LeaseLost(job['id'])
+
+    # Keep the chapter dicts the workers are holding on to
+    job.update({key: value for key, value in response['data'][0].items() if key != 'chapters'})
+    return job
+
+def is_permanent(e):
+    # Errors that running the job again would only repeat
+    if isinstance(e, ElevenLabsError):
+        return 400 <= e.status_code < 500 and e.status_code not in (408, 429)
+    if isinstance(e, HTTPException):
+        return e.status_code in (403, 404, 422)
+    return isinstance(e, (KeyError, ValueError))
+
+def claim_job(job_id):
+    job = get_synthesis_job(job_id)
+    if job['status'] in ('completed', 'failed'):
+        return None
+    # A live lease is never taken over, whoever holds it
+    if job['lease_owner'] is not None and (job['lease_expires'] or 0) > time.time():
+        return None
+    try:
+        if (job['attempts'] or 0) >= SYNTHESIS_JOB_MAX_ATTEMPTS:
+            release_job(job, job['lease_token'], 'failed', job['error'] or "Synthesis was interrupted too many times.")
+            return None
+        return swap_lease(job, job['lease_token'],
+                          {'status': 'running', 'lease_owner': WORKER_ID, 'lease_token': uuid4().hex,
+                           'attempts': (job['attempts'] or 0) + 1,
+                           'lease_expires': time.time() + SYNTHESIS_LEASE_SECONDS})
+    except LeaseLost:
+        return None
+
+def save_progress(job, token):
+    swap_lease(job, token, {'chapters': job['chapters'], 'lease_expires': time.time() + SYNTHESIS_LEASE_SECONDS})
+
+def release_job(job, token, status, error=None):
+    fields = {'status': status, 'error': error, 'chapters': job['chapters'], 'lease_owner': None,
+              'lease_token': uuid4().hex, 'lease_expires': 0}
+    if error is None:
+        # The run ended cleanly
+        fields['attempts'] = 0
+    swap_lease(job, token, fields)
+
+async def keep_lease(job, token, runner):
+    # Renew the lease until cancelled. Once it turns out someone else has
+    # taken the job, stop the runner and return.
+    while True:
+        await asyncio.sleep(SYNTHESIS_LEASE_SECONDS / 3)
+        try:
+            await run_in_threadpool(save_progress, job, token)
+        except LeaseLost:
+            runner.cancel()
+            return
+        except Exception:
+            # Try again next time; if the lease lapses meanwhile, the swap
+            # will say so
+            metrics.increment('synthesis_lease_renewal_failures')
+
+def previous_manifest(job, chapter):
+    manifest = load_manifest(job['user_id'], job['project_id'], chapter['file_id'])
+    if manifest is None or (manifest['voice_id'], manifest['settings']) != \
+            (job['voice_id'], settings_hash(job['model_id'], job['voice_settings'])):
+        return None
+    return manifest
+
+def plan_chapter(job, chapter):
+    # Segment rows for a chapter, creating them on the first visit. Segments
+    # the previous revision's manifest already has audio for start out done.
+    response = supabase.table('synthesis_segments') \
+                .select('id', 'index', 'segment_id', 'status', 'audio_key', 'attempts', 'duration') \
+                .match({'job_id': job['id'], 'file_id': chapter['file_id']}) \
+                .order('index') \
+                .execute()
+
+    segments = load_segments(chapter['text_sha256'])
+    if not segments:
+        # An empty chapter: nothing to synthesize, so nothing to insert
+        return segments, []
+    if response.get('data'):
+        return segments, response['data']
+
+    manifest = previous_manifest(job, chapter)
+    plan, chapter['stats'] = diff_segments(manifest['segments'] if manifest else [], segments)
+    metrics.increment('resynthesis_reused_segments', chapter['stats']['reused'])
+    metrics.increment('resynthesis_changed_segments', chapter['stats']['inserted'] + chapter['stats']['replaced'])
+
+    records = [
+        {
+            'job_id': job['id'],
+            'file_id': chapter['file_id'],
+            'index': segment['index'],
+            'segment_id': segment['id'],
+            'characters': len(segment['text']),
+            'status': 'done' if previous else 'pending',
+            'audio_key': previous['audio_key'] if previous else None,
+            'attempts': 0,
+        }
+        for segment, previous in plan
+    ]
+    response = supabase.table('synthesis_segments').insert(records).execute()
+
+    if not response or not response.get('data'):
+        raise HTTPException(status_code=400, detail="Failed to plan chapter.")
+
+    return segments, sorted(response['data'], key=lambda row: row['index'])
+
+def mark_segment(row, **fields):
+    supabase.table('synthesis_segments') \
+        .update(fields) \
+        .match({'id': row['id']}) \
+        .execute()
+    row.update(fields)
+
+def fail_segment(row, e):
+    detail = e.detail if isinstance(e, HTTPException) else str(e)
+    if is_permanent(e):
+        # No point trying again
+        mark_segment(row, status='failed', error=detail, attempts=max(row['attempts'], SYNTHESIS_MAX_ATTEMPTS))
+    else:
+        mark_segment(row, status='failed', error=detail)
+
+def finish_audio(audio):
+    audio = strip_tags(audio)
+    return audio, duration(audio)
+
+def segment_stages(client, job, segments, deadline):
+    # Synthesize, post-process and upload a chapter's segment rows as a
+    # pipeline (see pipeline.py). A segment only counts as done once its
+    # audio is in the cache.
+    async def synthesize(row):
+        await run_in_threadpool(mark_segment, row, status='in_flight', attempts=row['attempts'] + 1)
+        try:
+            audio, key, cached = await fetch_segment(client, job, segments[row['index']], deadline)
+        except DeadlineReached:
+            await run_in_threadpool(mark_segment, row, status='pending', attempts=row['attempts'] - 1)
+            return None
+        except Exception as e:
+            await run_in_threadpool(fail_segment, row, e)
+            return None
+        return row, audio, key, cached
+
+    async def post_process(item):
+        row, audio, key, cached = item
+        audio, seconds = await run_in_threadpool(finish_audio, audio)
+        return row, audio, key, cached, seconds
+
+    async def upload(item):
+        row, audio, key, cached, seconds = item
+        try:
+            if not cached:
+                await run_in_threadpool(put_cached_audio, key, audio)
+        except Exception as e:
+            await run_in_threadpool(fail_segment, row, e)
+            return None
+        await run_in_threadpool(mark_segment, row, status='done', audio_key=key, duration=seconds)
+        return None
+
+    return [
+        Stage('synthesize', synthesize, SYNTHESIS_CONCURRENCY),
+        Stage('post_process', post_process, PIPELINE_PROCESS_WORKERS),
+        Stage('upload', upload, PIPELINE_UPLOAD_WORKERS),
+    ]
+
+def join_segments(audio, rows):
+    # MP3 frames are self-contained, so the chapter is the segments' frames
+    # back to back
+    parts = [strip_tags(data) for data in audio]
+    seconds = sum(row.get('duration') or duration(part) for row, part in zip(rows, parts))
+    return b"".join(parts), round(seconds)
+
+async def assemble_chapter(job, chapter, segments, rows):
+    # Join the segments' audio into the chapter's MP3. Audio that has gone
+    # missing from S3 sends its segment back to pending.
+    audio = await asyncio.gather(*(run_in_threadpool(get_bytes, S3_BUCKET_NAME, row['audio_key']) for row in rows))
+    missing = [row for row, data in zip(rows, audio) if data is None]
+    for row in missing:
+        await run_in_threadpool(mark_segment, row, status='pending', audio_key=None)
+    if missing:
+        return False
+
+    user_id, project_id = job['user_id'], job['project_id']
+    manifest = await run_in_threadpool(previous_manifest, job, chapter)
+    body, audio_length = await run_in_threadpool(join_segments, audio, rows)
+    s3_path = chapter_audio_path(user_id, project_id, chapter['file_id'])
+    await run_in_threadpool(put_bytes, S3_BUCKET_NAME, s3_path, body, 'audio/mpeg')
+    file = await run_in_threadpool(save_audio_file, user_id, project_id,
+                                   {'id': chapter['file_id'], 'name': chapter['name']}, s3_path, len(body),
+                                   manifest['audio_file_id'] if manifest else None)
+
+    chapter_info = {'id': chapter['file_id'], 'text_sha256': chapter['text_sha256']}
+    entries = [(segment, row['audio_key']) for segment, row in zip(segments, rows)]
+    settings = settings_hash(job['model_id'], job['voice_settings'])
+    await run_in_threadpool(store_manifest, user_id, project_id, chapter['file_id'],
+                            build_manifest(chapter_info, job['voice_id'], settings, file['id'], audio_length,
+                                           entries, chapter.get('stats')))
+    characters = sum(len(segment['text']) for segment in segments)
+    await run_in_threadpool(update_synthesis, chapter['row_id'], successful=True, synthesized_audio=file['id'],
+                            audio_length=audio_length, text_sha256=chapter['text_sha256'], characters=characters)
+    return True
+
+async def process_chapter(client, job, chapter, deadline):
+    if time.monotonic() > deadline:
+        return
+
+    manifest = await run_in_threadpool(previous_manifest, job, chapter)
+    if manifest is not None and manifest['text_sha256'] == chapter['text_sha256']:
+        # Nothing changed since the chapter was last synthesized
+        metrics.increment('resynthesis_reused_segments', len(manifest['segments']))
+        await run_in_threadpool(update_synthesis, chapter['row_id'], successful=True,
+                                synthesized_audio=manifest['audio_file_id'], audio_length=manifest['audio_length'],
+                                text_sha256=chapter['text_sha256'],
+                                characters=sum(entry['characters'] for entry in manifest['segments']))
+        chapter['status'] = 'done'
+        return
+
+    segments, rows = await run_in_threadpool(plan_chapter, job, chapter)
+    if not segments:
+        await run_in_threadpool(update_synthesis, chapter['row_id'], successful=True, audio_length=0,
+                                text_sha256=chapter['text_sha256'], characters=0)
+        chapter['status'] = 'done'
+        return
+
+    while True:
+        exhausted = [row for row in rows if row['status'] == 'failed' and row['attempts'] >= SYNTHESIS_MAX_ATTEMPTS]
+        todo = [row for row in rows if row['status'] != 'done']
+        if exhausted or not todo or time.monotonic() > deadline:
+            break
+        await run_pipeline(todo, segment_stages(client, job, segments, deadline))
+
+    if exhausted:
+        await run_in_threadpool(update_synthesis, chapter['row_id'], successful=False, error=exhausted[0].get('error'))
+        chapter['status'] = 'failed'
+    elif all(row['status'] == 'done' for row in rows) and await assemble_chapter(job, chapter, segments, rows):
+        chapter['status'] = 'done'
+
+async def run_synthesis_job(job_id, budget=SYNTHESIS_TIME_BUDGET):
+    # Work on a job for up to `budget` seconds. Returns the job's status
+    # afterwards, or None if another worker holds it.
+    deadline = time.monotonic() + budget - SYNTHESIS_DEADLINE_MARGIN
+    if job_id in running:
+        return None
+    running.add(job_id)
+    try:
+        return await work_on_job(job_id, deadline)
+    finally:
+        running.discard(job_id)
+
+async def stop_chapters(tasks):
+    # Cancel the chapter tasks and wait for them to wind down, so none of
+    # them is still working on the job once it has been let go
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+async def work_on_job(job_id, deadline):
+    job = await run_in_threadpool(claim_job, job_id)
+    if job is None:
+        return None
+
+    token = job['lease_token']
+    renewer = asyncio.ensure_future(keep_lease(job, token, asyncio.current_task()))
+    chapters = []
+    try:
+        chapter_slots = asyncio.Semaphore(SYNTHESIS_CHAPTERS_IN_FLIGHT)
+
+        async def run(chapter):
+            async with chapter_slots:
+                await process_chapter(client, job, chapter, deadline)
+                await run_in_threadpool(save_progress, job, token)
+
+        client = get_client()
+        try:
+            await scheduler.sync_quota(client)
+        except Exception:
+            # Keep going on the locally tracked budget
+            metrics.increment('eleven_quota_sync_failures')
+        pending = [chapter for chapter in job['chapters'] if chapter['status'] == 'pending']
+        chapters = [asyncio.ensure_future(run(chapter)) for chapter in pending]
+        await asyncio.gather(*chapters)
+    except LeaseLost:
+        # Someone else took over after our lease lapsed; leave it to them
+        renewer.cancel()
+        await stop_chapters(chapters)
+        return None
+    except asyncio.CancelledError:
+        lost = renewer.done() and not renewer.cancelled()
+        renewer.cancel()
+        await stop_chapters(chapters)
+        if lost:
+            # The renewer found the lease taken and stopped us
+            return None
+        raise
+    except Exception as e:
+        renewer.cancel()
+        await stop_chapters(chapters)
+        detail = e.detail if isinstance(e, HTTPException) else str(e)
+        failed = is_permanent(e) or job['attempts'] >= SYNTHESIS_JOB_MAX_ATTEMPTS
+        status = 'failed' if failed else 'queued'
+        await run_in_threadpool(release_job, job, token, status, detail)
+        return status
+    finally:
+        renewer.cancel()
+
+    statuses = {chapter['status'] for chapter in job['chapters']}
+    if statuses == {'done'}:
+        status = 'completed'
+    elif 'pending' in statuses:
+        status = 'queued'
+    else:
+        status = 'failed'
+    await run_in_threadpool(release_job, job, token, status)
+    return status
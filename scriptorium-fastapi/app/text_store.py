@@ -0,0 +1,163 @@
+# text_store.py
+
+import hashlib
+import json
+import threading
+from bisect import bisect_right
+from collections import OrderedDict
+from functools import lru_cache
+from tempfile import SpooledTemporaryFile
+import zstandard
+from app.config import S3_BUCKET_NAME, TEXT_CHUNK_CHARS, TEXT_CHUNK_CACHE_SIZE
+from app.s3 import put_bytes, get_bytes, get_range
+
+# Extracted text lives in S3 rather than in the files table. A text is
+# stored under its SHA-256 as a run of independently zstd-compressed frames
+# of TEXT_CHUNK_CHARS characters each, next to a small JSON index of where
+# every frame starts in characters and in bytes. Reading a range of the
+# text fetches and decompresses only the frames that overlap it.
+#
+# Stored texts never change, so indexes and decompressed chunks are cached
+# in memory without any invalidation.
+
+chunk_cache = OrderedDict()
+chunk_cache_lock = threading.Lock()
+
+def text_path(sha256):
+    return f"texts/{sha256}.zst"
+
+def index_path(sha256):
+    return f"texts/{sha256}.idx.json"
+
+def iter_chunks(blocks, size=TEXT_CHUNK_CHARS):
+    # Re-cut a stream of text blocks into chunks of exactly `size` characters
+    buffer = ""
+    for block in blocks:
+        if buffer:
+            block = buffer + block
+        start = 0
+        while len(block) - start >= size:
+            yield block[start:start + size]
+            start += size
+        buffer = block[start:]
+    if buffer:
+        yield buffer
+
+def store_text(blocks):
+    # Compress and store a text given as an iterable of blocks (or a single
+    # string). Returns the pointer fields that go on the DB row.
+    if isinstance(blocks, str):
+        blocks = [blocks]
+
+    compressor = zstandard.ZstdCompressor(level=3)
+    digest = hashlib.sha256()
+    chunks = []
+    length = 0
+    with SpooledTemporaryFile(max_size=4 * 1024 * 1024) as spooled:
+        for chunk in iter_chunks(blocks):
+            digest.update(chunk.encode())
+            frame = compressor.compress(chunk.encode())
+            chunks.append([length, spooled.tell(), len(frame)])
+            spooled.write(frame)
+            length += len(chunk)
+
+        sha256 = digest.hexdigest()
+        # Content-addressed, so an existing index means the text is stored
+        if get_bytes(S3_BUCKET_NAME, index_path(sha256)) is None:
+            spooled.seek(0)
+            put_bytes(S3_BUCKET_NAME, text_path(sha256), spooled, 'application/zstd')
+            index = {'length': length, 'chunk_chars': TEXT_CHUNK_CHARS, 'chunks': chunks}
+            put_bytes(S3_BUCKET_NAME, index_path(sha256), json.dumps(index).encode(), 'application/json')
+
+    return {'text_path': text_path(sha256), 'text_sha256': sha256, 'text_length': length}
+
+@lru_cache(maxsize=1024)
+def load_index(sha256):
+    data = get_bytes(S3_BUCKET_NAME, index_path(sha256))
+    if data is None:
+        raise KeyError(sha256)
+    index = json.loads(data)
+    index['starts'] = [chunk[0] for chunk in index['chunks']]
+    return index
+
+def cached_chunk(sha256, number):
+    with chunk_cache_lock:
+        text = chunk_cache.get((sha256, number))
+        if text is not None:
+            chunk_cache.move_to_end((sha256, number))
+        return text
+
+def cache_chunk(sha256, number, text):
+    with chunk_cache_lock:
+        chunk_cache[(sha256, number)] = text
+        while len(chunk_cache) > TEXT_CHUNK_CACHE_SIZE:
+            chunk_cache.popitem(last=False)
+
+def fetch_chunks(sha256, index, first, last):
+    # Fetch and decompress chunks first..last (inclusive) with one ranged GET
+    chunks = index['chunks'][first:last + 1]
+    byte_start = chunks[0][1]
+    byte_end = chunks[-1][1] + chunks[-1][2]
+    data = get_range(S3_BUCKET_NAME, text_path(sha256), byte_start, byte_end - 1)
+
+    decompressor = zstandard.ZstdDecompressor()
+    texts = {}
+    for number, (_, frame_start, frame_length) in enumerate(chunks, first):
+        frame = data[frame_start - byte_start:frame_start - byte_start + frame_length]
+        texts[number] = decompressor.decompress(frame).decode()
+        cache_chunk(sha256, number, texts[number])
+    return texts
+
+def read_text(sha256, offset=0, length=None, index=None):
+    # Characters offset..offset+length of a stored text
+    index = index or load_index(sha256)
+    end = index['length'] if length is None else min(index['length'], offset + length)
+    offset = max(0, offset)
+    if offset >= end:
+        return ""
+
+    first = bisect_right(index['starts'], offset) - 1
+    last = bisect_right(index['starts'], end - 1) - 1
+    texts = {}
+    missing = []
+    for number in range(first, last + 1):
+        text = cached_chunk(sha256, number)
+        if text is None:
+            missing.append(number)
+        else:
+            texts[number] = text
+    if missing:
+        # One GET from the first missing chunk to the last missing one
+        texts.update(fetch_chunks(sha256, index, missing[0], missing[-1]))
+
+    text = "".join(texts[number] for number in range(first, last + 1))
+    start = index['starts'][first]
+    return text[offset - start:end - start]
+
+def iter_text(sha256):
+    # Yield a stored text chunk by chunk
+    index = load_index(sha256)
+    for char_start, _, _ in index['chunks']:
+        yield read_text(sha256, char_start, index['chunk_chars'], index)
+
+def iter_range(sha256, start, end, window_chunks=8):
+    # Yield characters start..end of a stored text a few chunks at a time
+    index = load_index(sha256)
+    window = index['chunk_chars'] * window_chunks
+    for offset in range(start, min(end, index['length']), window):
+        yield read_text(sha256, offset, min(window, end - offset), index)
+
+def iter_stripped(pieces):
+    # Like "".join(pieces).strip(), without joining: leading whitespace is
+    # dropped and trailing whitespace held back until more text follows it
+    started = False
+    held = ""
+    for piece in pieces:
+        if not started:
+            piece = piece.lstrip()
+            started = bool(piece)
+        body = piece.rstrip()
+        if body:
+            yield held + body
+            held = ""
+        held += piece[len(body):]
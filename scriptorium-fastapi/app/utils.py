@@ -1,15 +1,117 @@
 # utils.py
 
-from docx import Document
+import hashlib
+from fastapi import HTTPException
 import PyPDF2
+from app.config import UPLOAD_CHUNK_SIZE
+from app.docx_stream import iter_docx_paragraphs, find_docx_headings
 
-def extract_text(file):
-    if file.content_type == "application/pdf":
-        pdf_reader = PyPDF2.PdfFileReader(file.file)
-        text = " ".join(page.extractText() for page in pdf_reader.pages)
-    elif file.content_type == "application/vnd.openxmlformats-officedocument.wordprocessingml.document":
-        doc = Document(file.file)
-        text = " ".join(paragraph.text for paragraph in doc.paragraphs)
+PDF_TYPE = "application/pdf"
+DOCX_TYPE = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+TEXT_FILE_TYPES = [PDF_TYPE, DOCX_TYPE]
+FILE_TYPES = TEXT_FILE_TYPES + ["image/jpeg", "image/png"]
+VOICE_SAMPLE_TYPES = ["audio/mpeg", "audio/wav"]
+
+def iter_text_blocks(fileobj, content_type):
+    # Yield the text a page (PDF) or paragraph (DOCX) at a time
+    if content_type == PDF_TYPE:
+        pdf_reader = PyPDF2.PdfReader(fileobj)
+        for page in pdf_reader.pages:
+            yield page.extract_text()
+    elif content_type == DOCX_TYPE:
+        for _, text in iter_docx_paragraphs(fileobj):
+            yield text
     else:
-        raise ValueError(f"Unsupported file type: {file.content_type}")
-    return text
+        raise ValueError(f"Unsupported file type: {content_type}")
+
+def extract_text(fileobj, content_type):
+    return " ".join(iter_text_blocks(fileobj, content_type))
+
+def iter_text_file_blocks(path, content_type):
+    with open(path, 'rb') as fileobj:
+        yield from iter_text_blocks(fileobj, content_type)
+
+def count_pdf_pages(path):
+    with open(path, 'rb') as fileobj:
+        return len(PyPDF2.PdfReader(fileobj).pages)
+
+def extract_pdf_pages(path, start, end):
+    with open(path, 'rb') as fileobj:
+        pdf_reader = PyPDF2.PdfReader(fileobj)
+        return [pdf_reader.pages[i].extract_text() for i in range(start, end)]
+
+def find_pdf_outline(fileobj):
+    # (page index, title) of each top-level bookmark; nested bookmarks are
+    # sections within a chapter
+    pdf_reader = PyPDF2.PdfReader(fileobj)
+    headings = []
+    for item in pdf_reader.outline:
+        if isinstance(item, list):
+            continue
+        try:
+            page = pdf_reader.get_destination_page_number(item)
+        except Exception:
+            continue
+        if page >= 0:
+            headings.append((page, str(item.title).strip()))
+    return headings
+
+def find_headings(path, content_type):
+    # Chapter headings marked up in the document, as (block index, title)
+    with open(path, 'rb') as fileobj:
+        if content_type == PDF_TYPE:
+            return find_pdf_outline(fileobj)
+        elif content_type == DOCX_TYPE:
+            return find_docx_headings(fileobj)
+    return []
+
+def join_blocks(blocks, offsets):
+    # Yield text blocks one per line, appending to `offsets` where each
+    # block starts in the joined text as it goes. The newlines keep
+    # paragraph boundaries for the TTS chunker.
+    position = 0
+    for i, block in enumerate(blocks):
+        if i:
+            yield "\n"
+            position += 1
+        offsets.append(position)
+        yield block
+        position += len(block)
+
+def check_upload_size(size, limit):
+    # Reject on the declared size (Content-Length, or the size starlette
+    # recorded while spooling the form) before any bytes are moved.
+    if size is not None and int(size) > limit:
+        raise HTTPException(status_code=413, detail="File size exceeds limit")
+
+async def iter_upload(file, limit, chunk_size=UPLOAD_CHUNK_SIZE):
+    received = 0
+    while True:
+        chunk = await file.read(chunk_size)
+        if not chunk:
+            break
+        received += len(chunk)
+        if received > limit:
+            raise HTTPException(status_code=413, detail="File size exceeds limit")
+        yield chunk
+
+async def iter_request_body(request, limit):
+    received = 0
+    async for chunk in request.stream():
+        received += len(chunk)
+        if received > limit:
+            raise HTTPException(status_code=413, detail="File size exceeds limit")
+        yield chunk
+
+async def hash_chunks(chunks, digest):
+    async for chunk in chunks:
+        digest.update(chunk)
+        yield chunk
+
+def sha256_file(fileobj, chunk_size=UPLOAD_CHUNK_SIZE):
+    digest = hashlib.sha256()
+    fileobj.seek(0)
+    for chunk in iter(lambda: fileobj.read(chunk_size), b""):
+        digest.update(chunk)
+    fileobj.seek(0)
+    return digest.hexdigest()
@@ -0,0 +1,115 @@
+# voices.py
+
+import asyncio
+import mimetypes
+import posixpath
+import threading
+from tempfile import SpooledTemporaryFile
+from fastapi import HTTPException
+from starlette.concurrency import run_in_threadpool
+from app.config import S3_BUCKET_NAME, VOICE_SAMPLES_MAX_BYTES, VOICE_SAMPLE_SPOOL_SIZE, VOICE_SAMPLE_DOWNLOADS
+from app.s3 import download_fileobj
+
+# Speech samples for a voice clone are downloaded from S3 side by side into
+# spooled buffers (in memory up to VOICE_SAMPLE_SPOOL_SIZE each, a
+# temporary file past that) and handed straight to the multipart upload,
+# so cloning from twenty samples takes about one download and one upload.
+#
+# The samples together may not exceed VOICE_SAMPLES_MAX_BYTES. Bytes are
+# counted as they arrive, so a download stops as soon as the total goes
+# over, not after everything has been fetched.
+#
+# httpx sizes a file part by calling fileno() on it, which would make a
+# spooled buffer roll over to disk; samples small enough to stay in memory
+# are handed over as bytes instead.
+
+
+class SampleBudget:
+    # Bytes left for all of a clone's samples, shared by the download threads
+    def __init__(self, limit):
+        self.left = limit
+        self.lock = threading.Lock()
+
+    def spend(self, size):
+        with self.lock:
+            self.left -= size
+            if self.left < 0:
+                raise HTTPException(status_code=413, detail="Voice samples exceed size limit")
+
+
+class CountedWriter:
+    # Writes through to a sample's buffer, charging each write to the budget
+    def __init__(self, fileobj, budget):
+        self.fileobj = fileobj
+        self.budget = budget
+
+    def write(self, data):
+        self.budget.spend(len(data))
+        return self.fileobj.write(data)
+
+    def seek(self, *args):
+        return self.fileobj.seek(*args)
+
+    def tell(self):
+        return self.fileobj.tell()
+
+
+def sample_files(rows):
+    # voice_samples rows only record where a sample is; its name and type
+    # come from the key it was uploaded under
+    return [
+        {
+            'name': posixpath.basename(row['file_path']),
+            'type': mimetypes.guess_type(row['file_path'])[0],
+            'file_path': row['file_path'],
+        }
+        for row in rows
+    ]
+
+def close_samples(samples):
+    for _, sample, _ in samples:
+        if hasattr(sample, 'close'):
+            sample.close()
+
+def in_memory(sample):
+    # A sample's bytes if it never left memory, else the buffer itself
+    size = sample.seek(0, 2)
+    sample.seek(0)
+    if size > VOICE_SAMPLE_SPOOL_SIZE:
+        return sample
+    data = sample.read()
+    sample.close()
+    return data
+
+async def download_samples(files):
+    # (filename, bytes or buffer, content type) for each sample file row;
+    # the caller closes them with close_samples
+    if sum(file.get('size') or 0 for file in files) > VOICE_SAMPLES_MAX_BYTES:
+        raise HTTPException(status_code=413, detail="Voice samples exceed size limit")
+
+    downloads = asyncio.Semaphore(VOICE_SAMPLE_DOWNLOADS)
+    # The recorded sizes may be missing or stale
+    budget = SampleBudget(VOICE_SAMPLES_MAX_BYTES)
+    samples = [(file['name'], SpooledTemporaryFile(max_size=VOICE_SAMPLE_SPOOL_SIZE), file.get('type') or 'audio/mpeg')
+               for file in files]
+
+    async def download(file, sample):
+        async with downloads:
+            # Once over the limit, don't start any more downloads
+            if budget.left < 0:
+                return
+            await run_in_threadpool(download_fileobj, S3_BUCKET_NAME, file['file_path'],
+                                    CountedWriter(sample, budget))
+
+    try:
+        # Wait for every download to stop before closing any buffer
+        results = await asyncio.gather(*(download(file, sample) for file, (_, sample, _) in zip(files, samples)),
+                                       return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        samples = [(name, in_memory(sample), content_type) for name, sample, content_type in samples]
+    except BaseException:
+        close_samples(samples)
+        raise
+    return samples
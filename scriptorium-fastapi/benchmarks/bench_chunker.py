@@ -0,0 +1,70 @@
+# benchmarks/bench_chunker.py
+#
+# Throughput of the TTS chunker in app.chunker over generated prose, both as
+# DOCX text (one paragraph per line) and as PDF text (lines wrapped at a
+# fixed width), for a whole chapter at once and streamed in pieces.
+#
+#   python -m benchmarks.bench_chunker [--mb N] [--piece-size BYTES]
+
+import argparse
+import random
+import textwrap
+import time
+
+from app.chunker import iter_segments, split_segments
+
+WORDS = (
+    "the of and a to in he she was it his her that with as for had you not on at but by "
+    "said Mr. Dr. Holmes Watson London morning window letter door across quietly "
+    "remembered answered carriage evening suddenly"
+).split()
+
+def make_paragraph(rng):
+    sentences = []
+    for _ in range(rng.randint(1, 8)):
+        words = [rng.choice(WORDS) for _ in range(rng.randint(4, 30))]
+        sentence = " ".join(words).capitalize() + rng.choice(".!?")
+        if rng.random() < 0.2:
+            sentence = f'"{sentence}" {rng.choice(["he", "she"])} said.'
+        sentences.append(sentence)
+    return " ".join(sentences)
+
+def make_text(size, wrap, seed=0):
+    rng = random.Random(seed)
+    paragraphs = []
+    total = 0
+    while total < size:
+        paragraph = make_paragraph(rng)
+        if wrap:
+            paragraph = "\n".join(textwrap.wrap(paragraph, 76))
+        paragraphs.append(paragraph)
+        total += len(paragraph) + 1
+    return "\n".join(paragraphs)
+
+def run(name, text, piece_size):
+    megabytes = len(text.encode()) / 1e6
+
+    start = time.perf_counter()
+    segments = split_segments(text)
+    whole = time.perf_counter() - start
+
+    start = time.perf_counter()
+    streamed = sum(1 for _ in iter_segments(text[i:i + piece_size] for i in range(0, len(text), piece_size)))
+    stream = time.perf_counter() - start
+
+    print(f"{name:>5}: {megabytes:6.1f} MB  {len(segments)} segments  "
+          f"whole {megabytes / whole:6.1f} MB/s  streamed {megabytes / stream:6.1f} MB/s"
+          f"{'' if streamed == len(segments) else '  (segment count differs)'}")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--mb', type=float, default=20)
+    parser.add_argument('--piece-size', type=int, default=64 * 1024)
+    args = parser.parse_args()
+
+    size = int(args.mb * 1e6)
+    run('docx', make_text(size, wrap=False), args.piece_size)
+    run('pdf', make_text(size, wrap=True), args.piece_size)
+
+if __name__ == '__main__':
+    main()
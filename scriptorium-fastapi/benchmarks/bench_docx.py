@@ -0,0 +1,75 @@
+# benchmarks/bench_docx.py
+#
+# Compare DOCX text extraction through python-docx's Document with the
+# streaming iterparse path in app.docx_stream, for throughput and peak RSS.
+# Each extractor runs in a fresh process so their peak memory is measured
+# separately.
+#
+#   python -m benchmarks.bench_docx [manuscript.docx] [--chapters N]
+
+import argparse
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+
+def python_docx_paragraphs(path):
+    from docx import Document
+    return [p.text for p in Document(path).paragraphs]
+
+def streaming_paragraphs(path):
+    from app.docx_stream import iter_docx_paragraphs
+    with open(path, 'rb') as f:
+        return [text for _, text in iter_docx_paragraphs(f)]
+
+EXTRACTORS = {
+    'python-docx': python_docx_paragraphs,
+    'iterparse': streaming_paragraphs,
+}
+
+def make_manuscript(path, chapters):
+    from docx import Document
+    doc = Document()
+    sentence = "The quick brown fox jumps over the lazy dog while the author keeps on writing. "
+    for chapter in range(1, chapters + 1):
+        doc.add_heading(f"Chapter {chapter}", level=1)
+        for _ in range(60):
+            doc.add_paragraph(sentence * 8)
+    doc.save(path)
+
+def measure(name, path, results):
+    import app.docx_stream  # noqa: F401 (keep imports out of the timing)
+    import docx  # noqa: F401
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    paragraphs = EXTRACTORS[name](path)
+    elapsed = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results[name] = (elapsed, (peak - baseline) / 1024, sum(len(p) for p in paragraphs))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('path', nargs='?')
+    parser.add_argument('--chapters', type=int, default=40)
+    args = parser.parse_args()
+
+    path = args.path
+    if path is None:
+        path = os.path.join(tempfile.mkdtemp(), 'manuscript.docx')
+        make_manuscript(path, args.chapters)
+    size = os.path.getsize(path) / 1024 / 1024
+
+    results = multiprocessing.Manager().dict()
+    for name in EXTRACTORS:
+        process = multiprocessing.Process(target=measure, args=(name, path, results))
+        process.start()
+        process.join()
+
+    print(f"{path} ({size:.1f} MB)")
+    for name, (elapsed, peak_mb, chars) in results.items():
+        print(f"{name:>12}: {elapsed:7.3f}s  {chars / elapsed / 1e6:6.1f} M chars/s  "
+              f"peak +{peak_mb:7.1f} MB  {chars} chars")
+
+if __name__ == '__main__':
+    main()
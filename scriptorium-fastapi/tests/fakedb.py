@@ -0,0 +1,80 @@
+# tests/fakedb.py
+
+import copy
+import itertools
+
+# A small in-memory stand-in for the supabase client, covering the query
+# builder calls the app makes. Rows are plain dicts; every query returns
+# copies, as the real client would.
+
+
+class FakeQuery:
+    def __init__(self, db, table):
+        self.db = db
+        self.table = table
+        self.action = 'select'
+        self.payload = None
+        self.filters = []
+        self.ordering = None
+        self.count = None
+
+    def select(self, *columns):
+        self.action = 'select'
+        return self
+
+    def insert(self, records, upsert=False):
+        self.action = 'insert'
+        self.payload = records if isinstance(records, list) else [records]
+        return self
+
+    def update(self, fields):
+        self.action = 'update'
+        self.payload = fields
+        return self
+
+    def match(self, fields):
+        self.filters += [(key, lambda value, expected=expected: value == expected) for key, expected in fields.items()]
+        return self
+
+    def in_(self, column, values):
+        self.filters.append((column, lambda value: value in values))
+        return self
+
+    def order(self, column, desc=False):
+        self.ordering = (column, desc)
+        return self
+
+    def limit(self, count):
+        self.count = count
+        return self
+
+    def rows(self):
+        rows = [row for row in self.db.tables.setdefault(self.table, [])
+                if all(test(row.get(key)) for key, test in self.filters)]
+        if self.ordering:
+            column, desc = self.ordering
+            rows.sort(key=lambda row: row.get(column), reverse=desc)
+        return rows[:self.count] if self.count is not None else rows
+
+    def execute(self):
+        self.db.calls.append((self.table, self.action, self.payload))
+        if self.action == 'insert':
+            rows = [{'id': next(self.db.ids), **copy.deepcopy(record)} for record in self.payload]
+            self.db.tables.setdefault(self.table, []).extend(rows)
+        elif self.action == 'update':
+            rows = self.rows()
+            for row in rows:
+                row.update(copy.deepcopy(self.payload))
+        else:
+            rows = self.rows()
+        return {'data': copy.deepcopy(rows)}
+
+
+class FakeDB:
+    def __init__(self, **tables):
+        self.tables = {name: [dict(row) for row in rows] for name, rows in tables.items()}
+        self.ids = itertools.count(1000)
+        self.calls = []
+
+    def table(self, name):
+        return FakeQuery(self, name)
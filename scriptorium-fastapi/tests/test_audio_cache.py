@@ -0,0 +1,19 @@
+# tests/test_audio_cache.py
+
+from app.audio_cache import cache_key
+
+
+def test_key_ignores_whitespace_and_unicode_form():
+    assert cache_key("voice", "model", None, "Café  au\nlait.") == \
+        cache_key("voice", "model", {}, "Café au lait.")
+
+
+def test_key_changes_with_voice_and_settings():
+    text = "It was a quiet morning."
+    keys = {
+        cache_key("voice", "model", None, text),
+        cache_key("other", "model", None, text),
+        cache_key("voice", "model_v2", None, text),
+        cache_key("voice", "model", {'stability': 0.5}, text),
+    }
+    assert len(keys) == 4
@@ -0,0 +1,64 @@
+# tests/test_chunker.py
+
+from app.chunker import iter_segments, split_segments
+
+PARAGRAPH = "It was a quiet morning on Baker Street. Nothing much happened until noon."
+
+
+def texts(segments):
+    return [segment['text'] for segment in segments]
+
+
+def test_sentences_respect_abbreviations_and_dialogue():
+    text = ('Dr. Watson met J. R. Smith at 4 p.m. on the corner. "Stop!" he cried. '
+            '"Why?" She did not wait for an answer... Then it rained.')
+    assert texts(split_segments(text, target_chars=1, max_chars=60)) == [
+        "Dr. Watson met J. R. Smith at 4 p.m. on the corner.",
+        '"Stop!" he cried.',
+        '"Why?"',
+        "She did not wait for an answer...",
+        "Then it rained.",
+    ]
+
+
+def test_segments_close_at_paragraph_ends_under_the_limit():
+    text = "\n".join([PARAGRAPH] * 20)
+    segments = split_segments(text, target_chars=200, max_chars=300)
+    assert all(200 <= len(s['text']) <= 300 for s in segments[:-1])
+    assert all(s['text'].endswith("noon.") for s in segments)
+    assert " ".join(texts(segments)) == " ".join(text.split())
+
+
+def test_wrapped_lines_are_joined_and_headings_kept_apart():
+    text = ("Chapter One\n"
+            "This line was wrapped by the PDF layout because it runs past\n"
+            "the width of the page. The sentence ends here.")
+    assert texts(split_segments(text, target_chars=1, max_chars=500)) == [
+        "Chapter One",
+        "This line was wrapped by the PDF layout because it runs past the width of the page. "
+        "The sentence ends here.",
+    ]
+
+
+def test_overlong_sentences_are_cut_at_clauses():
+    text = "word, " * 100 + "end."
+    segments = split_segments(text, target_chars=1, max_chars=50)
+    assert all(len(s['text']) <= 50 for s in segments)
+    assert all(s['text'].endswith(",") for s in segments[:-1])
+
+
+def test_ids_are_stable_around_an_edit():
+    paragraphs = [f"Paragraph {i}. " + PARAGRAPH for i in range(30)]
+    before = split_segments("\n".join(paragraphs), target_chars=300, max_chars=600)
+    paragraphs[15] = "A new sentence here. " + paragraphs[15]
+    after = split_segments("\n".join(paragraphs), target_chars=300, max_chars=600)
+    unchanged = {s['id'] for s in before} & {s['id'] for s in after}
+    assert len(unchanged) >= len(before) - 3
+
+
+def test_streaming_matches_whole_text():
+    text = "\n\n".join([PARAGRAPH * 5, "Short line", PARAGRAPH * 40, "x. " * 3000])
+    whole = split_segments(text, target_chars=300, max_chars=500)
+    for size in (1, 17, 1000):
+        pieces = (text[i:i + size] for i in range(0, len(text), size))
+        assert list(iter_segments(pieces, target_chars=300, max_chars=500)) == whole
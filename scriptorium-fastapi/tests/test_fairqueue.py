@@ -0,0 +1,61 @@
+# tests/test_fairqueue.py
+
+import asyncio
+from app.fairqueue import FairQueue
+
+
+def run_order(requests, slots=1, weights=None):
+    # Queue (user, priority) requests while a slot is held, then record the
+    # order they are served in
+    async def run():
+        queue = FairQueue(slots, weights)
+        order = []
+
+        async def request(user, priority):
+            async with queue.slot(user, priority, cost=100):
+                order.append((user, priority))
+                await asyncio.sleep(0)
+
+        await queue.acquire('holder')
+        tasks = [asyncio.ensure_future(request(*r)) for r in requests]
+        await asyncio.sleep(0)
+        queue.release()
+        await asyncio.gather(*tasks)
+        # Nothing is queued, so no user's finish tag is still needed
+        assert queue.finish_tags == {}
+        return order
+
+    return asyncio.run(run())
+
+
+def test_preview_jumps_ahead_of_bulk_work():
+    order = run_order([('publisher', 'batch')] * 20 + [('author', 'export'), ('author', 'preview')])
+    assert order[:2] == [('author', 'preview'), ('author', 'export')]
+
+
+def test_users_share_a_class_fairly():
+    order = run_order([('publisher', 'export')] * 10 + [('author', 'export')] * 2)
+    authors = [i for i, (user, _) in enumerate(order) if user == 'author']
+    assert authors == [1, 3]
+
+
+def test_heavier_users_get_a_larger_share():
+    order = run_order([('publisher', 'export')] * 10 + [('author', 'export')] * 2,
+                      weights=lambda user: 4 if user == 'publisher' else 1)
+    authors = [i for i, (user, _) in enumerate(order) if user == 'author']
+    assert authors == [4, 9]
+
+
+def test_cancelled_waiters_do_not_hold_slots():
+    async def run():
+        queue = FairQueue(1)
+        await queue.acquire('a')
+        waiter = asyncio.ensure_future(queue.acquire('b'))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.sleep(0)
+        queue.release()
+        await asyncio.wait_for(queue.acquire('c'), 1)
+        return queue.queued
+
+    assert asyncio.run(run()) == {'preview': 0, 'export': 0, 'batch': 0}
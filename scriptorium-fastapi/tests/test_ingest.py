@@ -0,0 +1,31 @@
+# tests/test_ingest.py
+
+import pytest
+from app import ingest
+from app.ingest import insert_chapters
+from fakedb import FakeDB
+
+
+def chapter(title, length):
+    return {'title': title, 'text_path': f"texts/{title}.zst", 'text_sha256': title, 'text_length': length}
+
+
+@pytest.fixture
+def db(monkeypatch):
+    db = FakeDB(files=[], project_files=[])
+    monkeypatch.setattr(ingest, 'supabase', db)
+    return db
+
+
+def test_empty_chapters_are_skipped(db):
+    blob = {'chapters': [chapter("Title page", 0), chapter("Chapter 1", 1200), chapter("Chapter 2", 900)]}
+    chapters = insert_chapters('user', 7, 1, "book.docx", blob)
+    assert [c['title'] for c in chapters] == ["Chapter 1", "Chapter 2"]
+    assert [row['text_length'] for row in db.tables['files']] == [1200, 900]
+    assert [row['num_characters'] for row in db.tables['project_files']] == [1200, 900]
+
+
+def test_textless_upload_has_no_chapter_rows(db):
+    assert insert_chapters('user', 7, 1, "scan.pdf", {'chapters': [chapter(None, 0)]}) == []
+    assert insert_chapters('user', 7, 1, "scan.pdf", {'chapters': []}) == []
+    assert db.tables['files'] == [] and db.tables['project_files'] == []
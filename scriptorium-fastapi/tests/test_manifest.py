@@ -0,0 +1,42 @@
+# tests/test_manifest.py
+
+from app.chunker import split_segments
+from app.manifest import diff_segments
+
+PARAGRAPHS = [f"Paragraph {i} begins here. It was a quiet morning on Baker Street, and nothing "
+              f"much happened until noon, when the post arrived." for i in range(60)]
+
+
+def entries(segments):
+    return [{'id': s['id'], 'audio_key': f"audio/{s['id']}.mp3"} for s in segments]
+
+
+def test_one_sentence_edit_reuses_the_rest():
+    before = split_segments("\n".join(PARAGRAPHS), target_chars=400, max_chars=800)
+    edited = list(PARAGRAPHS)
+    edited[30] = edited[30].replace("quiet morning", "cold and foggy morning")
+    after = split_segments("\n".join(edited), target_chars=400, max_chars=800)
+
+    plan, stats = diff_segments(entries(before), after)
+    assert [segment for segment, _ in plan] == after
+    assert stats['inserted'] + stats['replaced'] == 1
+    assert stats['reused'] == len(after) - 1
+    changed = [segment for segment, previous in plan if previous is None]
+    assert sum(len(s['text']) for s in changed) < 800
+
+
+def test_reused_segments_point_at_their_old_audio():
+    before = split_segments("\n".join(PARAGRAPHS), target_chars=400, max_chars=800)
+    after = split_segments("\n".join(PARAGRAPHS[:10] + PARAGRAPHS[20:]), target_chars=400, max_chars=800)
+    plan, stats = diff_segments(entries(before), after)
+    assert stats['deleted'] > 0 and stats['inserted'] + stats['replaced'] <= 1
+    for segment, previous in plan:
+        if previous is not None:
+            assert previous['audio_key'] == f"audio/{segment['id']}.mp3"
+
+
+def test_first_synthesis_has_nothing_to_reuse():
+    segments = split_segments(PARAGRAPHS[0])
+    plan, stats = diff_segments([], segments)
+    assert all(previous is None for _, previous in plan)
+    assert stats == {'reused': 0, 'inserted': len(segments), 'replaced': 0, 'deleted': 0}
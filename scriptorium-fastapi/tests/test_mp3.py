@@ -0,0 +1,22 @@
+# tests/test_mp3.py
+
+import pytest
+from app.mp3 import strip_tags, duration
+
+
+def frame(marker=b""):
+    # One MPEG-1 Layer III frame, 128 kbps, 44.1 kHz, stereo, no padding
+    body = bytes(32) + marker
+    return b"\xff\xfb\x90\x00" + body + bytes(417 - 4 - len(body))
+
+
+def test_duration_counts_frames():
+    assert duration(frame() * 100) == pytest.approx(100 * 1152 / 44100)
+
+
+def test_tags_and_info_frame_are_stripped():
+    id3v2 = b"ID3\x04\x00\x00\x00\x00\x01\x00" + bytes(128)
+    id3v1 = b"TAG" + bytes(125)
+    audio = frame() * 10
+    assert strip_tags(id3v2 + frame(b"Info") + audio + id3v1) == audio
+    assert strip_tags(audio) is audio
@@ -0,0 +1,55 @@
+# tests/test_pipeline.py
+
+import asyncio
+from app.pipeline import Stage, run_pipeline
+
+
+def test_stages_overlap_and_queues_stay_bounded():
+    async def run():
+        seen, busy, peak = [], {'a': 0, 'b': 0}, {'a': 0, 'b': 0}
+        fed = []
+
+        def items():
+            for i in range(20):
+                fed.append(i)
+                yield i
+
+        def stage(name, delay):
+            async def func(item):
+                busy[name] += 1
+                peak[name] = max(peak[name], busy[name])
+                await asyncio.sleep(delay)
+                busy[name] -= 1
+                return item
+            return func
+
+        async def last(item):
+            # The feeder can only be a few items ahead of the slowest stage
+            assert len(fed) - len(seen) <= 2 + 2 + 2 + 4
+            await asyncio.sleep(0.02)
+            seen.append(item)
+
+        stages = [Stage('a', stage('a', 0.01), 2), Stage('b', stage('b', 0.01), 1), Stage('c', last, 1)]
+        processed = await run_pipeline(items(), stages, queue_size=2)
+        return processed, sorted(seen), peak
+
+    processed, seen, peak = asyncio.run(run())
+    assert processed == [20, 20, 20]
+    assert seen == list(range(20))
+    assert peak == {'a': 2, 'b': 1}
+
+
+def test_dropped_items_stop_at_their_stage():
+    async def run():
+        async def odd_only(item):
+            return item if item % 2 else None
+
+        out = []
+
+        async def collect(item):
+            out.append(item)
+
+        await run_pipeline(range(10), [Stage('filter', odd_only, 3), Stage('collect', collect)])
+        return sorted(out)
+
+    assert asyncio.run(run()) == [1, 3, 5, 7, 9]
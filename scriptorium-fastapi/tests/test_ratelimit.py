@@ -0,0 +1,75 @@
+# tests/test_ratelimit.py
+
+import asyncio
+import time
+import pytest
+from app.elevenlabs import ElevenLabsError
+from app.ratelimit import TokenBucket, Scheduler
+
+
+def test_bucket_paces_requests_after_the_burst():
+    async def run():
+        bucket = TokenBucket(rate=50, capacity=5)
+        started = time.monotonic()
+        for _ in range(10):
+            await bucket.acquire()
+        return time.monotonic() - started
+
+    # 5 from the burst, then 5 more at 50/s
+    assert 0.08 <= asyncio.run(run()) < 0.5
+
+
+def test_throttled_calls_are_retried_at_a_lower_rate():
+    async def run():
+        scheduler = Scheduler(requests_per_second=100, burst=1, min_requests_per_second=1,
+                              monthly_characters=1000)
+        attempts = []
+
+        async def call():
+            attempts.append(time.monotonic())
+            if len(attempts) < 3:
+                raise ElevenLabsError(429, '{"detail": {"status": "too_many_requests"}}', retry_after=0.05)
+            return "audio"
+
+        result = await scheduler.call(call, characters=10)
+        return scheduler, attempts, result
+
+    scheduler, attempts, result = asyncio.run(run())
+    assert result == "audio" and len(attempts) == 3
+    assert attempts[1] - attempts[0] >= 0.05
+    assert scheduler.requests.rate < 100
+    assert scheduler.characters.tokens == pytest.approx(990, abs=1)
+
+
+def test_spent_quota_fails_and_refunds_characters():
+    async def run():
+        scheduler = Scheduler(requests_per_second=100, burst=1, min_requests_per_second=1,
+                              monthly_characters=1000)
+
+        async def call():
+            raise ElevenLabsError(429, '{"detail": {"status": "quota_exceeded"}}')
+
+        with pytest.raises(ElevenLabsError):
+            await scheduler.call(call, characters=10)
+        return scheduler
+
+    assert asyncio.run(run()).characters.tokens == pytest.approx(1000, abs=1)
+
+
+def test_server_errors_are_retried_with_backoff():
+    async def run():
+        scheduler = Scheduler(requests_per_second=100, burst=10, min_requests_per_second=1,
+                              monthly_characters=1000, max_retries=2, backoff=0.01)
+        attempts = []
+
+        async def call():
+            attempts.append(time.monotonic())
+            raise ElevenLabsError(503, "unavailable")
+
+        with pytest.raises(ElevenLabsError):
+            await scheduler.call(call)
+        return scheduler, attempts
+
+    scheduler, attempts = asyncio.run(run())
+    assert len(attempts) == 3
+    assert scheduler.requests.rate == 100
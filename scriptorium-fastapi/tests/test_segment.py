@@ -0,0 +1,65 @@
+# tests/test_segment.py
+
+from app.segment import segment_text, split_chapters, regex_boundaries, HeadingScanner, MIN_CHAPTER_CHARS
+
+BODY = "Some prose that goes on for a while. " * 40
+
+
+def blocks_to_text(blocks):
+    offsets = []
+    position = 0
+    for block in blocks:
+        offsets.append(position)
+        position += len(block) + 1
+    return "\n".join(blocks), offsets
+
+
+def test_markup_headings_are_preferred():
+    text, offsets = blocks_to_text(["Chapter 1", BODY, "Interlude", BODY, "Chapter 2", BODY])
+    chapters = segment_text(text, offsets, [(0, "Chapter 1"), (2, "Interlude"), (4, "Chapter 2")])
+    assert [c['title'] for c in chapters] == ["Chapter 1", "Interlude", "Chapter 2"]
+    assert chapters[0]['start'] == 0 and chapters[-1]['end'] == len(text)
+
+
+def test_regex_fallback_skips_table_of_contents():
+    toc = "Contents\nChapter One ..... 3\nChapter Two ..... 9\n"
+    text = toc + "Chapter One: Arrival\n" + BODY + "\nCHAPTER TWO\n" + BODY
+    chapters = segment_text(text, [0], [])
+    assert [c['title'] for c in chapters] == ["Chapter One: Arrival", "CHAPTER TWO"]
+    assert chapters[0]['start'] == 0
+
+
+def test_scanner_matches_across_pieces():
+    text = "Preface\n" + BODY + "\nChapter 1\n" + BODY + "\nChapter 2: The Road\n" + BODY
+    scanner = HeadingScanner()
+    pieces = [text[i:i + 7] for i in range(0, len(text), 7)]
+    assert "".join(scanner.scan(pieces)) == text
+    assert scanner.boundaries() == regex_boundaries(text)
+    assert [title for _, title in scanner.boundaries()] == ["Preface", "Chapter 1", "Chapter 2: The Road"]
+
+
+def test_short_chapters_fold_into_neighbours():
+    boundaries = [(200, "Part One"), (300, "Chapter 1"), (2000, "Chapter 2"), (2990, "The End")]
+    chapters = split_chapters(3000, boundaries)
+    assert [(c['title'], c['start'], c['end']) for c in chapters] == [
+        ("Chapter 1", 0, 2000),
+        ("Chapter 2", 2000, 3000),
+    ]
+
+
+def test_chapter_at_the_minimum_stands_alone():
+    # One character short of the minimum folds into the next chapter
+    end = 2 * MIN_CHAPTER_CHARS
+    exact = split_chapters(end, [(0, "Part One"), (MIN_CHAPTER_CHARS, "Chapter 1")])
+    short = split_chapters(end, [(0, "Part One"), (MIN_CHAPTER_CHARS - 1, "Chapter 1")])
+    assert [c['title'] for c in exact] == ["Part One", "Chapter 1"]
+    assert [(c['title'], c['start'], c['end']) for c in short] == [("Chapter 1", 0, end)]
+
+
+def test_no_headings_is_one_chapter():
+    assert split_chapters(1234, []) == [{'title': None, 'start': 0, 'end': 1234}]
+
+
+def test_empty_text_has_no_chapters():
+    assert split_chapters(0, []) == []
+    assert segment_text("", [0], []) == []
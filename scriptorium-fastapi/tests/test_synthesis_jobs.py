@@ -0,0 +1,148 @@
+# tests/test_synthesis_jobs.py
+
+import asyncio
+import time
+import pytest
+from fastapi import HTTPException
+from app import synthesis_jobs
+from app.elevenlabs import ElevenLabsError
+from app.synthesis_jobs import LeaseLost, claim_job, run_synthesis_job
+from fakedb import FakeDB
+
+
+def job_row(*file_ids, **fields):
+    return {
+        'id': 1,
+        'user_id': 'user',
+        'project_id': 7,
+        'voice_id': 'voice',
+        'model_id': 'model',
+        'voice_settings': None,
+        'priority': 'export',
+        'status': 'queued',
+        'chapters': [{'file_id': file_id, 'name': f"Chapter {file_id}", 'text_sha256': f"sha-{file_id}",
+                      'row_id': file_id, 'status': 'pending'} for file_id in file_ids],
+        'lease_token': 'first',
+        'lease_owner': None,
+        'lease_expires': 0,
+        'attempts': 0,
+        'error': None,
+        **fields,
+    }
+
+
+class FakeScheduler:
+    async def sync_quota(self, client):
+        pass
+
+
+@pytest.fixture
+def db(monkeypatch):
+    db = FakeDB(synthesis_jobs=[job_row(1, 2)], synthesis_segments=[])
+    monkeypatch.setattr(synthesis_jobs, 'supabase', db)
+    monkeypatch.setattr(synthesis_jobs, 'get_client', lambda: None)
+    monkeypatch.setattr(synthesis_jobs, 'scheduler', FakeScheduler())
+    return db
+
+
+def run_job(monkeypatch, process_chapter, settle=0.1):
+    # Run the job with a stand-in for process_chapter, then give anything
+    # left running a moment to show itself
+    monkeypatch.setattr(synthesis_jobs, 'process_chapter', process_chapter)
+
+    async def run():
+        status = await run_synthesis_job(1)
+        await asyncio.sleep(settle)
+        return status
+
+    return asyncio.run(run())
+
+
+def test_failed_chapter_stops_the_others(db, monkeypatch):
+    finished = []
+
+    async def process_chapter(client, job, chapter, deadline):
+        if chapter['file_id'] == 1:
+            await asyncio.sleep(0)
+            raise HTTPException(status_code=400, detail="Failed to plan chapter.")
+        await asyncio.sleep(0.05)
+        chapter['status'] = 'done'
+        finished.append(chapter['file_id'])
+
+    assert run_job(monkeypatch, process_chapter) == 'queued'
+    assert finished == []
+    row = db.tables['synthesis_jobs'][0]
+    assert (row['status'], row['lease_owner'], row['attempts']) == ('queued', None, 1)
+    assert [chapter['status'] for chapter in row['chapters']] == ['pending', 'pending']
+
+
+def test_lost_lease_stops_every_chapter(db, monkeypatch):
+    monkeypatch.setattr(synthesis_jobs, 'SYNTHESIS_LEASE_SECONDS', 0.03)
+    finished = []
+
+    async def process_chapter(client, job, chapter, deadline):
+        # Another worker takes the job over
+        db.tables['synthesis_jobs'][0].update({'lease_token': 'theirs', 'lease_owner': 'other'})
+        await asyncio.sleep(1)
+        finished.append(chapter['file_id'])
+
+    assert run_job(monkeypatch, process_chapter) is None
+    assert finished == []
+    row = db.tables['synthesis_jobs'][0]
+    assert (row['status'], row['lease_token'], row['lease_owner']) == ('running', 'theirs', 'other')
+
+
+@pytest.mark.parametrize('error, status', [
+    (ElevenLabsError(404, "voice_not_found"), 'failed'),
+    (ElevenLabsError(429, "too_many_concurrent_requests"), 'queued'),
+    (HTTPException(status_code=400, detail="Failed to update synthesis."), 'queued'),
+])
+def test_permanent_errors_fail_and_transient_ones_requeue(db, monkeypatch, error, status):
+    async def process_chapter(client, job, chapter, deadline):
+        raise error
+
+    assert run_job(monkeypatch, process_chapter, settle=0) == status
+    assert db.tables['synthesis_jobs'][0]['status'] == status
+
+
+def test_empty_chapter_is_done_without_segments(db, monkeypatch):
+    db.tables['synthesis_jobs'] = [job_row(1)]
+    updates = []
+    monkeypatch.setattr(synthesis_jobs, 'previous_manifest', lambda job, chapter: None)
+    monkeypatch.setattr(synthesis_jobs, 'load_segments', lambda text_sha256: [])
+    monkeypatch.setattr(synthesis_jobs, 'update_synthesis', lambda row_id, **fields: updates.append(fields))
+
+    assert run_job(monkeypatch, synthesis_jobs.process_chapter, settle=0) == 'completed'
+    assert db.tables['synthesis_segments'] == []
+    assert updates == [{'successful': True, 'audio_length': 0, 'text_sha256': 'sha-1', 'characters': 0}]
+    row = db.tables['synthesis_jobs'][0]
+    assert (row['attempts'], row['error']) == (0, None)
+
+
+def test_live_lease_is_not_claimed(db):
+    db.tables['synthesis_jobs'][0].update({'status': 'running', 'lease_owner': 'other',
+                                          'lease_expires': time.time() + 60})
+    assert claim_job(1) is None
+
+    db.tables['synthesis_jobs'][0]['lease_expires'] = time.time() - 1
+    job = claim_job(1)
+    assert job['lease_owner'] == synthesis_jobs.WORKER_ID
+    assert job['lease_token'] != 'first' and job['attempts'] == 1
+
+
+def test_saves_after_release_are_refused(db):
+    job = claim_job(1)
+    token = job['lease_token']
+    synthesis_jobs.release_job(job, token, 'queued')
+    with pytest.raises(LeaseLost):
+        synthesis_jobs.save_progress(job, token)
+
+
+def test_job_fails_once_out_of_attempts(db, monkeypatch):
+    db.tables['synthesis_jobs'][0]['attempts'] = synthesis_jobs.SYNTHESIS_JOB_MAX_ATTEMPTS
+
+    async def process_chapter(client, job, chapter, deadline):
+        raise AssertionError("should not run")
+
+    assert run_job(monkeypatch, process_chapter, settle=0) is None
+    assert db.tables['synthesis_jobs'][0]['status'] == 'failed'
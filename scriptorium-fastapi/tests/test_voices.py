@@ -0,0 +1,108 @@
+# tests/test_voices.py
+
+import asyncio
+import mimetypes
+import time
+import pytest
+from fastapi import FastAPI, HTTPException
+from fastapi.testclient import TestClient
+from app import routes, voices
+from app.deps import get_current_user
+from app.voices import download_samples, close_samples
+from fakedb import FakeDB
+
+SIZES = {'user/voice-samples/short.mp3': 50, 'user/voice-samples/long.wav': 300,
+         'user/voice-samples/huge.mp3': 5000}
+
+
+@pytest.fixture
+def downloads(monkeypatch):
+    # Stands in for S3: writes each object's bytes in small pieces and
+    # records which object every write belonged to
+    writes = []
+
+    def download_fileobj(bucket, key, fileobj):
+        for _ in range(SIZES[key] // 10):
+            fileobj.write(b"x" * 10)
+            writes.append(key)
+            time.sleep(0.001)
+        fileobj.seek(0)
+
+    monkeypatch.setattr(voices, 'download_fileobj', download_fileobj)
+    monkeypatch.setattr(voices, 'VOICE_SAMPLE_SPOOL_SIZE', 100)
+    monkeypatch.setattr(voices, 'VOICE_SAMPLES_MAX_BYTES', 1000)
+    return writes
+
+
+def sample_rows(*keys):
+    return [{'name': key.rsplit('/', 1)[1], 'type': None, 'file_path': key} for key in keys]
+
+
+def test_small_samples_are_handed_over_as_bytes(downloads):
+    samples = asyncio.run(download_samples(sample_rows('user/voice-samples/short.mp3',
+                                                       'user/voice-samples/long.wav')))
+    try:
+        assert samples[0][1] == b"x" * 50
+        assert samples[1][1].read() == b"x" * 300
+    finally:
+        close_samples(samples)
+
+
+def test_samples_over_the_budget_stop_downloading(downloads):
+    rows = sample_rows('user/voice-samples/short.mp3', 'user/voice-samples/long.wav', 'user/voice-samples/huge.mp3')
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(download_samples(rows))
+    assert error.value.status_code == 413
+    # The big sample was cut off soon after the total went over
+    assert len(downloads) * 10 <= 1000 + 10 * voices.VOICE_SAMPLE_DOWNLOADS
+    assert downloads.count('user/voice-samples/huge.mp3') < 500
+
+
+@pytest.fixture
+def client(monkeypatch, downloads):
+    db = FakeDB(voice_samples=[], custom_voice=[])
+    monkeypatch.setattr(routes, 'supabase', db)
+    app = FastAPI()
+    app.include_router(routes.router)
+    app.dependency_overrides[get_current_user] = lambda: {'id': 'user'}
+    client = TestClient(app)
+    client.db = db
+    return client
+
+
+def test_clone_without_samples_is_a_400(client):
+    client.db.tables['voice_samples'] = [{'user_id': 'someone else', 'file_path': 'other/voice-samples/a.mp3'}]
+    response = client.post("/voice-clone", params={'voice_name': "Narrator"})
+    assert response.status_code == 400
+    assert response.json() == {'detail': "No voice samples to clone from."}
+
+
+def test_clone_over_the_sample_budget_is_a_413(client):
+    client.db.tables['voice_samples'] = [{'user_id': 'user', 'file_path': key} for key in SIZES]
+    response = client.post("/voice-clone", params={'voice_name': "Narrator"})
+    assert response.status_code == 413
+    assert response.json() == {'detail': "Voice samples exceed size limit"}
+
+
+def test_clone_uses_uploaded_samples(client, monkeypatch):
+    client.db.tables['voice_samples'] = [{'user_id': 'user', 'file_path': 'user/voice-samples/short.mp3'},
+                                         {'user_id': 'user', 'file_path': 'user/voice-samples/long.wav'}]
+    sent = []
+
+    async def add_voice(client, name, samples):
+        sent.extend((filename, content_type) for filename, _, content_type in samples)
+        return {'voice_id': 'cloned'}
+
+    class Scheduler:
+        async def call(self, request):
+            return await request()
+
+    monkeypatch.setattr(routes, 'add_voice', add_voice)
+    monkeypatch.setattr(routes, 'scheduler', Scheduler())
+    monkeypatch.setattr(routes, 'get_client', lambda: None)
+
+    response = client.post("/voice-clone", params={'voice_name': "Narrator"})
+    assert response.status_code == 200
+    assert response.json() == {'voice_id': 'cloned'}
+    assert sorted(sent) == [('long.wav', mimetypes.guess_type('long.wav')[0]), ('short.mp3', 'audio/mpeg')]
+    assert [row['user_id'] for row in client.db.tables['custom_voice']] == ['user']